@@ -0,0 +1,479 @@
+import argparse
+import asyncio
+import base64
+import itertools
+import os
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# cogs.Base reads its settings from config; the harness brings its own
+config = types.ModuleType('config')
+config.guilds = []
+config.embed_update_window = 1.0
+config.prefetch_lookahead = 3
+config.queue_load_concurrency = 5
+config.node_check_interval = 0.5
+sys.modules.setdefault('config', config)
+
+import wavelink  # noqa: E402
+
+from cogs.Base import CustomQueueSelect, MusicalBase, PlayerView  # noqa: E402
+from utils.catalog import MusicCache, SongCatalog  # noqa: E402
+from utils.history import PlayHistory  # noqa: E402
+from utils.metrics import metrics  # noqa: E402
+from utils.queue import TrackQueue  # noqa: E402
+from utils.state import GuildStates  # noqa: E402
+from utils.store import StoredCache  # noqa: E402
+from utils.track_cache import TrackCache  # noqa: E402
+from utils.tracks import migrate_custom_queues, serialize_track  # noqa: E402
+
+
+class Latency:
+    search = 0.08
+    rest = 0.03
+    lavalink = 0.005
+
+    @staticmethod
+    async def wait(seconds: float):
+        # jitter so requests do not complete in lockstep
+        await asyncio.sleep(seconds * random.uniform(0.5, 1.5))
+
+
+def encode_track(title: str, author: str, length: int, identifier: str) -> str:
+    def utf(text: str) -> bytes:
+        data = text.encode('utf-8')
+        return struct.pack('>H', len(data)) + data
+
+    uri = f'https://www.youtube.com/watch?v={identifier}'
+    body = (struct.pack('>B', 2) + utf(title) + utf(author) + struct.pack('>q', length) + utf(identifier)
+            + struct.pack('>?', False) + struct.pack('>?', True) + utf(uri) + utf('youtube') + struct.pack('>q', 0))
+    return base64.b64encode(struct.pack('>I', 1 << 30 | len(body)) + body).decode()
+
+
+def make_track(query: str) -> wavelink.YouTubeTrack:
+    identifier = f'{abs(hash(query)) % 10 ** 11:011d}'
+    length = random.randint(120, 360) * 1000
+    info = {'title': query.title(), 'author': 'Stand-in Artist', 'length': length, 'identifier': identifier,
+            'isStream': False, 'isSeekable': True, 'position': 0, 'sourceName': 'youtube',
+            'uri': f'https://www.youtube.com/watch?v={identifier}'}
+    return wavelink.YouTubeTrack(encode_track(info['title'], info['author'], length, identifier), info)
+
+
+async def fake_search(cls, query, *, return_first=False, **kwargs):
+    await Latency.wait(Latency.search)
+    track = make_track(query)
+    return track if return_first else [track]
+
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self, bot, channel):
+        self.bot = bot
+        self.id = next(self.ids)
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        await Latency.wait(Latency.rest)
+        self.bot.rest_calls += 1
+
+    async def delete(self):
+        await Latency.wait(Latency.rest)
+        self.bot.rest_calls += 1
+
+
+class FakeChannel:
+    def __init__(self, bot, guild, channel_id: int):
+        self.bot = bot
+        self.guild = guild
+        self.id = channel_id
+        self.rtc_region = None
+        self.members = [types.SimpleNamespace(id=guild.id + 1, bot=False)]
+
+    def get_partial_message(self, message_id: int):
+        message = FakeMessage(self.bot, self)
+        message.id = message_id
+        return message
+
+    async def connect(self, cls=None):
+        await Latency.wait(Latency.rest)
+        # placed like MusicPlayer does it, through the bot's NodeManager
+        node = self.bot.nodes.best_node(region=self.rtc_region, guild_id=self.guild.id)
+        self.guild.voice_client = FakePlayer(self.bot, self.guild, self, node)
+        node._players[self.guild.id] = self.guild.voice_client
+        return self.guild.voice_client
+
+
+class FakeNode:
+    # players register here the way they do on a wavelink Node, `load`
+    # stands in for the system load Lavalink reports
+    def __init__(self, identifier: str = 'stand-in', load: float = 0.0):
+        self.identifier = identifier
+        self.load = load
+        self.connected = True
+        self._players = {}
+
+    @property
+    def players(self) -> dict:
+        return self._players
+
+    @property
+    def stats(self):
+        return types.SimpleNamespace(playing_players=sum(1 for player in self._players.values() if player.track),
+                                     system_load=self.load, frames_deficit=0, frames_nulled=0)
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def get_tracks(self, cls, query):
+        await Latency.wait(Latency.lavalink)
+        # a few videos went away since they were queued, the prefetcher drops them
+        return [] if random.random() < 0.01 else [query]
+
+
+class FakePlayer:
+    # the parts of wavelink.Player the cog uses, events are fed back into the cog
+    def __init__(self, bot, guild, channel, node):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.node = node
+        self._voice_state = {}
+        self.queue = TrackQueue()
+        self.track = None
+        self.volume = 100
+        self.position = 0
+        self._paused = False
+
+    def is_playing(self) -> bool:
+        return self.track is not None
+
+    def is_paused(self) -> bool:
+        return self._paused
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def play(self, track, **kwargs):
+        await Latency.wait(Latency.lavalink)
+        previous, self.track = self.track, track
+        if previous is not None:
+            self._dispatch('track_end', previous, 'REPLACED')
+        self._dispatch('track_start', track)
+
+    async def stop(self):
+        await Latency.wait(Latency.lavalink)
+        if self.track is not None:
+            self.end('STOPPED')
+
+    def end(self, reason: str):
+        # like wavelink: the source is cleared before the event goes out
+        track, self.track = self.track, None
+        return self._dispatch('track_end', track, reason)
+
+    def _dispatch(self, event: str, track, *args):
+        # wavelink hands the listeners a plain Track rebuilt from the encoded
+        # string, never the object that was queued
+        listener = getattr(self.bot.cog, f'on_wavelink_{event}')
+        task = asyncio.get_running_loop().create_task(listener(self, wavelink.Track(track.id, track.info), *args))
+        task.add_done_callback(self.bot.listener_done)
+        return task
+
+    async def pause(self):
+        self._paused = True
+
+    async def resume(self):
+        self._paused = False
+
+    async def set_volume(self, volume: int):
+        self.volume = volume
+
+    async def seek(self, position: int):
+        self.position = position
+
+    async def disconnect(self, **kwargs):
+        self.node._players.pop(self.guild.id, None)
+        self.guild.voice_client = None
+
+    async def _dispatch_voice_update(self, data):
+        await Latency.wait(Latency.lavalink)
+
+
+class FakeGuild:
+    def __init__(self, bot, guild_id: int):
+        self.id = guild_id
+        self.voice_client = None
+        self.channel = FakeChannel(bot, self, guild_id * 10)
+
+    def get_channel(self, channel_id: int):
+        return self.channel
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def _respond(self):
+        await Latency.wait(Latency.rest)
+        self.interaction.bot.rest_calls += 1
+        self.done = True
+
+    async def send_message(self, content=None, *, view=None, **kwargs):
+        await self._respond()
+        self.interaction.message = FakeMessage(self.interaction.bot, self.interaction.guild.channel)
+        if isinstance(view, PlayerView):
+            self.interaction.bot.views[self.interaction.guild.id] = view
+
+    async def edit_message(self, **kwargs):
+        await self._respond()
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+    async def send_modal(self, modal):
+        await self._respond()
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, *, view=None, **kwargs):
+        await Latency.wait(Latency.rest)
+        self.interaction.bot.rest_calls += 1
+        if isinstance(view, PlayerView):
+            self.interaction.bot.views[self.interaction.guild.id] = view
+        return FakeMessage(self.interaction.bot, self.interaction.guild.channel)
+
+
+class FakeInteraction:
+    def __init__(self, bot, guild: FakeGuild):
+        self.bot = bot
+        self.client = bot
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = types.SimpleNamespace(id=guild.id + 1, voice=types.SimpleNamespace(channel=guild.channel))
+        self.message = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_message(self):
+        return self.message
+
+
+class FakeBot:
+    def __init__(self, directory: str, guilds: int):
+        self.loop = asyncio.get_running_loop()
+        self.rest_calls = 0
+        self.listener_errors = defaultdict(int)
+        self.views = {}
+        self.user = object()
+        self.cache = MusicCache(os.path.join(directory, 'data.json'))
+        self.cache.load()
+        self.songs = SongCatalog.from_data(self.cache.cache)
+        self.cache.songs = self.songs
+        self.songs.to_data(self.cache.cache)
+        self.states = GuildStates(self.cache, self)
+        self.custom_queues = StoredCache(os.path.join(directory, 'queues.json'))
+        self.custom_queues.load()
+        self.tracks = TrackCache(os.path.join(directory, 'tracks.json'))
+        self.tracks.load()
+        self.history = PlayHistory(os.path.join(directory, 'history.sqlite3'))
+        self.history.open()
+        self.guilds = {guild_id: FakeGuild(self, guild_id) for guild_id in range(1, guilds + 1)}
+
+    def guild_queues(self, guild_id) -> dict:
+        key = str(guild_id)
+        queues = self.custom_queues.get(key, {})
+        migrate_custom_queues({key: queues})
+        return queues
+
+    def get_guild(self, guild_id: int):
+        return self.guilds.get(guild_id)
+
+    def get_partial_messageable(self, channel_id: int):
+        return self.guilds[channel_id // 10].channel
+
+    async def wait_until_ready(self):
+        pass
+
+    def is_closed(self) -> bool:
+        return False
+
+    async def is_owner(self, user) -> bool:
+        return False
+
+    def listener_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.listener_errors[f'{type(task.exception()).__name__}: {task.exception()}'] += 1
+
+
+class QueueSelect(CustomQueueSelect):
+    # the selected value normally comes from the interaction payload
+    values = property(lambda self: ['mix'])
+
+
+class LoadTest:
+    def __init__(self, bot, cog, songs: int):
+        self.bot = bot
+        self.cog = cog
+        self.queries = [f'stand-in song {number}' for number in range(songs)]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def timed(self, name: str, coroutine):
+        started = time.perf_counter()
+        try:
+            await coroutine
+        except Exception as e:
+            self.errors[f'{name}: {type(e).__name__}'] += 1
+        self.latencies[name].append(time.perf_counter() - started)
+
+    def pick(self, guild: FakeGuild) -> tuple:
+        player = guild.voice_client
+        if player is None or player.track is None:
+            return random.choice([('play', self.play), ('queue_load', self.queue_load)])
+        return random.choices([('play', self.play), ('queue_load', self.queue_load), ('skip', self.skip),
+                               ('track_end', self.track_end)], weights=[5, 1, 2, 3])[0]
+
+    async def play(self, guild: FakeGuild):
+        await self.cog._play.callback(self.cog, FakeInteraction(self.bot, guild), random.choice(self.queries))
+
+    async def queue_load(self, guild: FakeGuild):
+        interaction = FakeInteraction(self.bot, guild)
+        await QueueSelect(self.bot, guild, 'play').callback(interaction)
+
+    async def skip(self, guild: FakeGuild):
+        view = self.bot.views.get(guild.id)
+        if view is None:
+            return await self.play(guild)
+        await PlayerView.skip_a_song(view, FakeInteraction(self.bot, guild), None)
+
+    async def track_end(self, guild: FakeGuild):
+        player = guild.voice_client
+        if player is not None and player.track is not None:
+            await player.end('FINISHED')
+
+    async def run(self, duration: float, rate: float):
+        tasks = set()
+        guilds = list(self.bot.guilds.values())
+        started = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - started < duration:
+            # keep the configured rate even if the loop falls behind
+            due = int((time.perf_counter() - started) * rate) - sent
+            for _ in range(due):
+                guild = random.choice(guilds)
+                name, operation = self.pick(guild)
+                task = asyncio.get_running_loop().create_task(self.timed(name, operation(guild)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            sent += max(due, 0)
+            await asyncio.sleep(0.001)
+        await asyncio.gather(*tasks)
+        return sent, time.perf_counter() - started
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] if ordered else 0.0
+
+
+async def main(args):
+    random.seed(args.seed)
+    wavelink.YouTubeTrack.search = classmethod(fake_search)
+    Latency.search, Latency.rest, Latency.lavalink = args.search_latency, args.rest_latency, args.lavalink_latency
+    with tempfile.TemporaryDirectory() as directory:
+        # start from the repo's data.json, like the bot does
+        shutil.copy(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data.json'), directory)
+        bot = FakeBot(directory, args.guilds)
+        cog = bot.cog = MusicalBase(bot)
+        bot.nodes.connect = bot.wait_until_ready
+        for number in range(args.nodes):
+            node = FakeNode(f'stand-in-{number}', load=number * 0.1)
+            bot.nodes.nodes[node.identifier] = node
+        test = LoadTest(bot, cog, args.songs)
+        for guild_id in bot.guilds:
+            bot.custom_queues.cache[str(guild_id)] = {
+                'mix': [serialize_track(make_track(query)) for query in random.sample(test.queries, args.queue_length)]}
+            # finished tracks come round again in these guilds
+            bot.states.get(guild_id).loop_queue = guild_id % 2 == 0
+            # and these keep playing from their history once the queue runs out
+            bot.states.get(guild_id).radio = guild_id % 3 == 0
+
+        # every guild starts a session once, measured for memory
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for guild in bot.guilds.values():
+            await test.play(guild)
+        await asyncio.sleep(config.embed_update_window * 1.5)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        per_guild = sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / len(bot.guilds)
+        test.latencies.clear()
+
+        placed = {identifier: len(node.players) for identifier, node in bot.nodes.nodes.items()}
+
+        async def fail_node():
+            # the monitor has to notice and move every player off the node
+            await asyncio.sleep(args.duration / 2)
+            next(iter(bot.nodes.nodes.values())).connected = False
+
+        lag = asyncio.get_running_loop().create_task(metrics.watch_loop_lag(0.05))
+        monitor = asyncio.get_running_loop().create_task(bot.nodes.monitor())
+        failure = asyncio.get_running_loop().create_task(fail_node()) if args.nodes > 1 else None
+        sent, elapsed = await test.run(args.duration, args.rate)
+        await asyncio.sleep(config.node_check_interval * 2)
+        lag.cancel()
+        monitor.cancel()
+        await bot.history.flush()
+        await bot.cache.flush()
+        logged, requested = bot.history._read('SELECT COUNT(*), COUNT(requester) FROM plays', ())[0]
+
+    print(f'{args.guilds} guilds, {sent} operations in {elapsed:.1f}s ({sent / elapsed:.0f} ops/s)')
+    for name, samples in sorted(test.latencies.items()):
+        print(f'  {name:<11} n={len(samples):<7} p50 {statistics.median(samples) * 1000:8.1f}ms '
+              f'p99 {percentile(samples, 0.99) * 1000:8.1f}ms')
+    loop_lag = next((summary for (name, _), summary in metrics.summaries.items() if name == 'event_loop_lag'), None)
+    if loop_lag is not None:
+        print(f'  event loop lag p50 {loop_lag.quantile(0.5) * 1000:.1f}ms p99 {loop_lag.quantile(0.99) * 1000:.1f}ms')
+    print(f'  memory per guild {per_guild / 1024:.1f} KiB')
+    print(f'  players per node after the first sessions {placed}')
+    print(f'  players per node at the end {({identifier: len(node.players) for identifier, node in bot.nodes.nodes.items()})}'
+          f'{", first node failed halfway" if failure is not None else ""}, {bot.nodes.moved} players moved')
+    print(f'  REST calls {bot.rest_calls}, embed edits {bot.embeds.edits}, coalesced {bot.embeds.coalesced}, '
+          f'track cache {bot.tracks.stats()}')
+    print(f'  {logged} plays logged, {requested} with a requester')
+    for error, count in sorted(test.errors.items()):
+        print(f'  error {error}: {count}')
+    for error, count in sorted(bot.listener_errors.items()):
+        print(f'  listener error {error}: {count}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive the music cog with stand-in Discord and Lavalink objects')
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=200, help='operations per second across all guilds')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--songs', type=int, default=5000, help='distinct search queries')
+    parser.add_argument('--queue-length', type=int, default=10, help='tracks per saved custom queue')
+    parser.add_argument('--search-latency', type=float, default=Latency.search)
+    parser.add_argument('--rest-latency', type=float, default=Latency.rest)
+    parser.add_argument('--lavalink-latency', type=float, default=Latency.lavalink)
+    parser.add_argument('--nodes', type=int, default=3, help='stand-in Lavalink nodes, the first fails halfway through')
+    parser.add_argument('--seed', type=int, default=51)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.search import SearchIndex  # noqa: E402
+
+WORDS = ['love', 'night', 'official', 'video', 'remix', 'feat', 'live', 'müde', 'über', 'straße', 'café', 'hallelujah',
+         'payphone', 'rock', 'roll', 'lyrics', 'prod', 'music', 'dance', 'ehrenloser', 'griechischer', 'wein', 'hole',
+         'ssio', 'gzuz', 'mocro', 'terminal', 'antarctica', 'thelema', 'kaputt', 'auto', 'song', 'klopapier']
+
+
+def make_titles(count: int, rng: random.Random) -> list:
+    titles = set()
+    while len(titles) < count:
+        words = rng.choices(WORDS, k=rng.randint(2, 7))
+        titles.add(f"{' '.join(words).title()} {rng.randint(0, count)}")
+    return list(titles)
+
+
+def make_queries(titles: list, count: int, rng: random.Random) -> list:
+    queries = []
+    for _ in range(count):
+        title = rng.choice(titles)
+        start = rng.randrange(len(title))
+        queries.append(title[start:start + rng.randint(1, 12)])
+    return queries
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run(size: int, queries: int, seed: int):
+    rng = random.Random(seed)
+    titles = make_titles(size, rng)
+    started = time.perf_counter()
+    index = SearchIndex(titles)
+    build = time.perf_counter() - started
+
+    timings = []
+    for query in make_queries(titles, queries, rng):
+        started = time.perf_counter()
+        index.search(query, limit=25)
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f'{size:>9} titles  build {build:7.2f}s  '
+          f'p50 {statistics.median(timings):7.3f}ms  p99 {percentile(timings, 0.99):7.3f}ms  '
+          f'max {max(timings):7.3f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Autocomplete latency of utils.search.SearchIndex')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=51)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, args.seed)
@@ -1,6 +1,17 @@
+import time
+started = time.perf_counter()
+
 import asyncio
 import traceback
-from Cache.Cache import Cache
+from utils.catalog import MusicCache, SongCatalog
+from utils.history import PlayHistory
+from utils.metrics import metrics
+from utils.sharding import parse_shard_config, partition_file
+from utils.startup import StartupTimer, command_tree_hash
+from utils.state import GuildStates
+from utils.store import StoredCache
+from utils.track_cache import TrackCache
+from utils.tracks import migrate_custom_queues
 import atexit
 import signal
 import sys
@@ -18,35 +29,80 @@ initial_extensions = (
 
 )
 
-
-class MusicCache(Cache):
-    def get_loop_string(self, guild_id: str) -> str:
-        if self.cache[guild_id]['loop']:
-            return ":white_check_mark: Looping"
-        else:
-            return ":x: Not Looping"
-
-    def save(self):
-        keys = list(bot.cache.cache.keys())
-        for i in range(2, len(keys) - 1):
-            self.cache[keys[i]]['message'] = None
-        super().save()
-
-    async def get_message(self, guild: discord.Guild):
-        channel = guild.get_channel(self._cache[str(guild.id)]['message_id'][1])
-        msg = await channel.fetch_message(self._cache[str(guild.id)]['message_id'][0])
-        return msg
+shards = parse_shard_config(config)
+startup = StartupTimer(('config', 'cache load', 'extension load', 'ready', 'node connect'), started)
+startup.mark('config')
 
 
-class DJ(commands.Bot):
+# a process owning a range of shards keeps its own data, queue and track files
+class DJ(commands.AutoShardedBot if shards.sharded else commands.Bot):
 
     def __init__(self):
-        self.cache = MusicCache("./data.json")
+        backend = getattr(config, 'persistence_backend', 'json')
+        delay = getattr(config, 'persistence_delay', 5.0)
+        self.cache = MusicCache(partition_file("./data.json", shards), backend=backend, delay=delay)
         self.cache.load()
-        self.custom_queues = Cache("./queues.json")
-        self.custom_queues.load()
-        super().__init__(command_prefix='!', intents=intents, case_insensitive=True, application_id=config.app_id)
-        self.files_cleaned = False
+        self.songs = SongCatalog.from_data(self.cache.cache,
+                                           limit=getattr(config, 'known_songs_limit', 10000),
+                                           policy=getattr(config, 'known_songs_eviction', 'lru'))
+        self.cache.songs = self.songs
+        # song_metadata is shared with the catalog from here on, encode it
+        # once in full so later writes can update single entries
+        self.songs.to_data(self.cache.cache)
+        self.songs.take_changes()
+        self.cache.mark_dirty('song_metadata')
+        self.cache.mark_dirty('known_songs')
+        self.states = GuildStates(self.cache, self, idle_after=getattr(config, 'guild_idle_after', 30 * 60))
+        self.custom_queues = StoredCache(partition_file("./queues.json", shards), backend=backend, delay=delay)
+        self.custom_queues.load(eager=())
+        self.tracks = TrackCache(partition_file("./tracks.json", shards),
+                                 ttl=getattr(config, 'track_cache_ttl', 7 * 24 * 60 * 60),
+                                 limit=getattr(config, 'track_cache_limit', 5000),
+                                 backend=backend, delay=delay)
+        self.tracks.load()
+        self.tracks.purge()
+        self.history = PlayHistory(shards.path('./history.sqlite3'), delay=delay,
+                                   batch=getattr(config, 'history_batch_size', 200))
+        self.history.open()
+        self.startup = startup
+        startup.mark('cache load')
+        super().__init__(command_prefix='!', intents=intents, case_insensitive=True, application_id=config.app_id,
+                         **shards.bot_kwargs())
+
+    def guild_queues(self, guild_id) -> dict:
+        key = str(guild_id)
+        queues = self.custom_queues.get(key, {})
+        if migrate_custom_queues({key: queues}):
+            self.custom_queues.mark_dirty(key)
+        return queues
+
+    def is_guild_active(self, guild_id: str) -> bool:
+        guild = self.get_guild(int(guild_id))
+        return guild is not None and guild.voice_client is not None
+
+    async def evict_idle_guilds(self):
+        await self.wait_until_ready()
+        while not self.is_closed():
+            await asyncio.sleep(60)
+            for guild_id in self.states.evict_idle(self.is_guild_active):
+                self.custom_queues.release(guild_id)
+                self.history.release(int(guild_id))
+
+    async def sync_commands(self, force: bool = False) -> bool:
+        # syncing is rate limited, only do it when the commands actually changed
+        hashes = self.cache.cache.setdefault('command_tree_hash', {})
+        synced = False
+        for guild in [None] + list(config.guilds):
+            key = 'global' if guild is None else str(guild.id)
+            digest = command_tree_hash(self.tree, guild)
+            if force or hashes.get(key) != digest:
+                await self.tree.sync(guild=guild)
+                hashes[key] = digest
+                synced = True
+                print(f'Synced {key} commands')
+        if synced:
+            self.cache.mark_dirty('command_tree_hash')
+        return synced
 
     async def setup_hook(self) -> None:
         print('setup hook')
@@ -57,30 +113,18 @@ class DJ(commands.Bot):
             except Exception as exc:
                 print(f"Failed to load {extension}, with {exc}")
                 traceback.print_exc()
-        await self.tree.sync(guild=config.guilds[0])
-        self.loop.create_task(self.cache.automatic_save())
+        startup.mark('extension load')
+        self.loop.create_task(self.sync_commands())
+        self.loop.create_task(self.evict_idle_guilds())
+        self.loop.create_task(metrics.watch_loop_lag())
+        if getattr(config, 'metrics_port', None):
+            await metrics.serve(getattr(config, 'metrics_host', '127.0.0.1'), config.metrics_port)
+        if getattr(config, 'metrics_log_interval', None):
+            self.loop.create_task(metrics.log_periodically(config.metrics_log_interval))
 
     async def on_ready(self) -> None:
         print("We have gone online")
-        if not self.files_cleaned:
-            for guild in self.guilds:
-                if str(guild.id) not in list(self.cache.cache.keys()):
-                    self.cache.cache[str(guild.id)] = {
-                        "loop": False,
-                        "message": None,
-                    }
-                if str(guild.id) not in self.custom_queues.cache.keys():
-                    self.custom_queues.cache[str(guild.id)] = {}
-            self.cache.save()
-
-    async def on_guild_join(self, guild):
-        if str(guild.id) not in list(self.cache.cache.keys()):
-            self.cache.cache[str(guild.id)] = {
-                "loop": False,
-                "message": None,
-            }
-            if str(guild.id) not in self.custom_queues.cache.keys():
-                self.custom_queues.cache[str(guild.id)] = {}
+        startup.mark('ready')
 
     def run(self) -> None:
         try:
@@ -105,6 +149,8 @@ def exited():
     # run the async exit_function
     bot.custom_queues.save()
     bot.cache.save()
+    bot.tracks.save()
+    bot.history.flush_sync()
 
 
 def signal_handler(sig, frame):
@@ -1,3 +1,4 @@
+import asyncio
 
 import discord
 from discord.ext import commands
@@ -5,13 +6,23 @@ from discord import app_commands
 import wavelink
 
 import config
+from utils.actors import Busy, GuildActors
+from utils.embeds import EmbedUpdater
+from utils.lifecycle import PlayerReaper
+from utils.messages import MessageHandle
+from utils.metrics import SamplingProfiler, metrics
+from utils.nodes import NodeManager, node_players
+from utils.player import MusicPlayer
+from utils.prefetch import Prefetcher
+from utils.track_cache import split_queries
+from utils.tracks import load_entry, serialize_track
 
 
 
 
 async def get_player(guild, user) -> wavelink.Player:
     if not guild.voice_client:
-        player: wavelink.Player = await user.voice.channel.connect(cls=wavelink.Player)
+        player: wavelink.Player = await user.voice.channel.connect(cls=MusicPlayer)
     else:
         player: wavelink.Player = guild.voice_client
     return player
@@ -27,24 +38,45 @@ def create_embed(bot, player: wavelink.Player, track):
         embed = discord.Embed(title=track.title, description=track.author, url=track.uri)
         embed.set_thumbnail(url=track.thumbnail)
         embed.add_field(name='Length', value=format_length(track.duration), inline=True)
-        embed.add_field(name='Loop', value=bot.cache.get_loop_string(str(player.guild.id)), inline=True)
-        embed.add_field(name='State', value=':white_check_mark: Playing', inline=True)
-        embed.set_footer(text=f'Volume: {player.volume}%')
-        x = 1
-        for item in player.queue:
-            if x == 21:
-                embed.add_field(name='\u200b', value=f'...{len(player.queue)-21} more tracks in queue', inline=False)
-                break
-            embed.add_field(name=x, value=f'{item.title} - {item.author}', inline=False)
-            x += 1
+        embed.add_field(name='Loop', value=bot.states.get(player.guild.id).loop_string(), inline=True)
+        embed.add_field(name='State', value=':clock1: Not Playing' if player.is_paused() else ':white_check_mark: Playing', inline=True)
+        state = bot.states.get(player.guild.id)
+        embed.set_footer(text=f'Volume: {player.volume}%' + (' | Looping queue' if state.loop_queue else ''))
+        for position, item in enumerate(player.queue.page(0, 20), start=1):
+            embed.add_field(name=position, value=f'{item.title} - {item.author}', inline=False)
+        if len(player.queue) > 20:
+            embed.add_field(name='\u200b', value=f'...{len(player.queue)-20} more tracks in queue', inline=False)
         return embed
     else:
         return discord.Embed(title='Queue is empty')
 
 
-def add_song_to_song_list(bot, guild: discord.Guild, song: wavelink.YouTubeTrack):
-    if song.title not in bot.cache.cache['known_songs']:
-        bot.cache.cache['known_songs'].append(song.title)
+def create_queue_embed(player: wavelink.Player, page: int, per_page: int = 10):
+    pages = max(1, -(-len(player.queue) // per_page))
+    page = max(1, min(page, pages))
+    embed = discord.Embed(title=f'Queue - {len(player.queue)} tracks')
+    if player.track is not None:
+        embed.description = f'Now playing: {player.track.title} - {player.track.author}'
+    start = (page - 1) * per_page
+    for position, item in enumerate(player.queue.page(start, per_page), start=start + 1):
+        embed.add_field(name=position, value=f'{item.title} - {item.author} ({format_length(item.duration)})', inline=False)
+    embed.set_footer(text=f'Page {page}/{pages}')
+    return embed
+
+
+def add_song_to_song_list(bot, guild: discord.Guild, songs: list):
+    for song in songs:
+        bot.songs.add(song)
+    save_song_changes(bot)
+
+
+def save_song_changes(bot):
+    # only the touched song_metadata entries are encoded again
+    changed, resized = bot.songs.take_changes()
+    for title in changed:
+        bot.cache.mark_dirty('song_metadata', title)
+    if resized:
+        bot.cache.mark_dirty('known_songs')
 
 
 def get_time(arg):
@@ -59,33 +91,109 @@ def get_time(arg):
     return skip[0], skip[1]
 
 
-class AddSongModal(discord.ui.Modal, title='Add a song'):
+def too_many_queries(text: str):
+    # the error to answer with when `text` holds more searches than one batch may
+    limit = getattr(config, 'max_queries_per_batch', 25)
+    if len(split_queries(text)) > limit:
+        return f'At most {limit} songs can be added at once.'
+    return None
+
+
+async def enqueue(bot, interaction: discord.Interaction, text: str):
+    # Resolves every query and playlist in `text` as one batch, queues the
+    # tracks with a single extend and answers the deferred interaction once.
+    new_session = interaction.guild.voice_client is None
+    tracks, failed = await bot.tracks.resolve_batch(text, concurrency=getattr(config, 'queue_load_concurrency', 5))
+    if not tracks:
+        return await interaction.followup.send('No song could be found.', ephemeral=True)
+    add_song_to_song_list(bot, interaction.guild, tracks)
+    for track in tracks:
+        track.requester = interaction.user.id
+
+    async def add(count):
+        player: wavelink.Player = await get_player(interaction.guild, interaction.user)
+        first = tracks[0] if player.track is None else None
+        # queued before playing so the prefetcher already sees the next tracks
+        player.queue.extend(tracks[1:] if first is not None else tracks)
+        if first is not None:
+            await player.play(first)
+        return player, first
+
+    future, _ = await submit(bot, interaction, 'enqueue', add)
+    if future is None:
+        return
+    player, first = await future
+    missing = f"Could not find: {', '.join(failed)}" if failed else None
+
+    if new_session:
+        embed = create_embed(bot=bot, player=player, track=player.track or first)
+        msg = await interaction.followup.send(content=missing, embed=embed,
+                                              view=PlayerView(client=bot, guild=interaction.guild), wait=True)
+        bot.embeds.remember(interaction.guild_id, embed)
+        state = bot.states.get(interaction.guild_id)
+        state.loop = False
+        state.set_message(MessageHandle.from_message(bot, msg))
+        bot.states.save(state)
+        return
+
+    bot.prefetch.schedule(player)
+    bot.embeds.request(interaction.guild)
+    if len(tracks) > 1:
+        content = f"Added {len(tracks)} tracks to queue"
+    elif first is not None:
+        content = f"Resumed Playback with {first.title}"
+    else:
+        content = f"Added {tracks[0].title} to queue"
+    if missing:
+        content += f"\n{missing}"
+    return await interaction.followup.send(content, ephemeral=True)
+
+
+class AddSongModal(discord.ui.Modal, title='Add songs'):
     def __init__(self, bot, queue=None):
         self.bot = bot
         self.queue = queue
         super().__init__(timeout=None)
-    song = discord.ui.TextInput(required=True,
-                                label='Song title')
+    song = discord.ui.TextInput(required=True, style=discord.TextStyle.paragraph,
+                                label='Song titles or a playlist link, one per line')
 
+    @metrics.timed('modal', modal='add_song')
     async def on_submit(self, interaction: discord.Interaction):
-        song = await wavelink.YouTubeTrack.search(self.song.value, return_first=True)
+        error = too_many_queries(self.song.value)
+        if error is not None:
+            return await interaction.response.send_message(error, ephemeral=True)
         if self.queue is None:
-            add_song_to_song_list(self.bot, interaction.guild, song)
-            try:
-                player: wavelink.Player = await get_player(guild=interaction.guild, user=interaction.user)
-                if player.track is not None:
-                    player.queue.put(song)
-                else:
-                    await player.play(song)
-                msg = self.bot.cache.cache[str(interaction.guild.id)]['message']
-                await msg.edit(embed=create_embed(bot=self.bot, player=player, track=player.track or song))
-                await interaction.response.send_message(f'Added {song.title} to queue.', ephemeral=True)
-            except Exception as e:
-                print(e)
-                await interaction.response.send_message("No song could be found.", ephemeral=True)
-        else:
-            self.bot.custom_queues[str(interaction.guild_id)][self.queue].append(song.title)
-            await interaction.response.send_message(f'Added {song.title} to {self.queue}')
+            if interaction.user.voice is None:
+                return await interaction.response.send_message('You are not in a voice channel', ephemeral=True)
+            await interaction.response.defer(ephemeral=interaction.guild.voice_client is not None)
+            return await enqueue(self.bot, interaction, self.song.value)
+
+        await interaction.response.defer()
+        tracks, failed = await self.bot.tracks.resolve_batch(self.song.value,
+                                                             concurrency=getattr(config, 'queue_load_concurrency', 5))
+        self.bot.guild_queues(interaction.guild_id)[self.queue].extend(serialize_track(track) for track in tracks)
+        self.bot.custom_queues.mark_dirty(str(interaction.guild_id))
+        content = f'Added {tracks[0].title if len(tracks) == 1 else f"{len(tracks)} songs"} to {self.queue}'
+        if failed:
+            content += f", could not find: {', '.join(failed)}"
+        await interaction.followup.send(content)
+
+
+async def submit(bot, interaction: discord.Interaction, kind: str, run, merge: bool = False) -> tuple:
+    # Queues a player operation on the guild's actor, (None, None) after
+    # answering the interaction when the guild has too much pending.
+    try:
+        return bot.actors.submit(interaction.guild_id, kind, run, merge=merge)
+    except Busy:
+        await reply(interaction, 'The player is busy, try again in a moment.')
+        return None, None
+
+
+async def reply(interaction: discord.Interaction, content: str):
+    # ephemeral answer to an interaction that may already be deferred
+    if interaction.response.is_done():
+        return await interaction.followup.send(content, ephemeral=True)
+    return await interaction.response.send_message(content, ephemeral=True)
 
 
 class PlayerView(discord.ui.View):
@@ -96,78 +204,202 @@ class PlayerView(discord.ui.View):
         self.add_item(CustomQueueSelect(self.bot, guild, "play"))
 
     @discord.ui.button(label='Pause', style=discord.ButtonStyle.red)
+    @metrics.timed('button', button='pause')
     async def toggle_play_state(self, interaction: discord.Interaction, button: discord.ui.Button):
-        player: wavelink.Player = await get_player(interaction.guild, interaction.user)
-        embed = interaction.message.embeds[0]
-        if player is not None:
-            if button.label == "Pause":
-                if not player.is_paused():
-                    await player.pause()
-                else:
-                    pass
-                button.label = "Resume"
-                button.style = discord.ButtonStyle.green
-                embed.set_field_at(2, name='State', value=':clock1: Not Playing')
-            else:
-                if player.is_paused():
-                    await player.resume()
+        async def toggle(count):
+            player: wavelink.Player = await get_player(interaction.guild, interaction.user)
+            embed = interaction.message.embeds[0]
+            if player is not None:
+                if button.label == "Pause":
+                    if not player.is_paused():
+                        await player.pause()
+                    else:
+                        pass
+                    button.label = "Resume"
+                    button.style = discord.ButtonStyle.green
+                    embed.set_field_at(2, name='State', value=':clock1: Not Playing')
                 else:
-                    pass
-                button.label = "Pause"
-                button.style = discord.ButtonStyle.red
-                embed.set_field_at(2, name='State', value=':white_check_mark: Playing')
+                    if player.is_paused():
+                        await player.resume()
+                    else:
+                        pass
+                    button.label = "Pause"
+                    button.style = discord.ButtonStyle.red
+                    embed.set_field_at(2, name='State', value=':white_check_mark: Playing')
 
-        await interaction.response.edit_message(view=self)
+            self.bot.embeds.remember(interaction.guild_id, embed)
+            await interaction.response.edit_message(view=self, embed=embed)
+
+        future, _ = await submit(self.bot, interaction, 'pause', toggle)
+        if future is not None:
+            await future
 
     @discord.ui.button(label='Add Song', style=discord.ButtonStyle.blurple)
+    @metrics.timed('button', button='add_song')
     async def add_song_to_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
         return await interaction.response.send_modal(AddSongModal(self.bot))
 
     @discord.ui.button(label='Skip', style=discord.ButtonStyle.blurple)
+    @metrics.timed('button', button='skip')
     async def skip_a_song(self, interaction: discord.Interaction, button: discord.ui.Button):
-        player: wavelink.Player = await get_player(interaction.guild, interaction.user)
-        if player is not None:
+        async def skip(count):
+            player: wavelink.Player = await get_player(interaction.guild, interaction.user)
+            # rapid clicks arrive as one skip over `count` tracks
+            for _ in range(min(count, len(player.queue)) - 1):
+                player.queue.get()
             if not player.queue.is_empty:
-                track = await player.queue.get_wait()
+                track = player.queue.get()
                 await player.play(track)
             else:
                 track = None
                 await player.stop()
+            return player, track
 
-            await interaction.response.edit_message(embed=create_embed(bot=self.bot, player=player, track=track))
+        future, merged = await submit(self.bot, interaction, 'skip', skip, merge=True)
+        if future is None:
+            return
+        if merged:
+            # the first click of the burst updates the message
+            return await interaction.response.defer()
+        player, track = await future
+        embed = create_embed(bot=self.bot, player=player, track=track)
+        self.bot.embeds.remember(interaction.guild_id, embed)
+        await interaction.response.edit_message(embed=embed)
 
     @discord.ui.button(label='Loop', style=discord.ButtonStyle.red)
+    @metrics.timed('button', button='loop')
     async def loop_current_song(self, interaction: discord.Interaction, button: discord.ui.Button):
-        player: wavelink.Player = await get_player(interaction.guild, interaction.user)
-        embed = interaction.message.embeds[0]
-        if player is not None:
-            if self.bot.cache.cache[str(interaction.guild_id)]['loop']:
-                self.bot.cache.cache[str(interaction.guild_id)]['loop'] = False
-                button.style = discord.ButtonStyle.red
-                embed.set_field_at(1, name='Loop', value=':x: Not Looping')
-            else:
-                self.bot.cache.cache[str(interaction.guild_id)]['loop'] = True
-                button.style = discord.ButtonStyle.green
-                embed.set_field_at(1, name='Loop', value=':white_check_mark: Looping')
+        async def toggle(count):
+            player: wavelink.Player = await get_player(interaction.guild, interaction.user)
+            embed = interaction.message.embeds[0]
+            if player is not None:
+                state = self.bot.states.get(interaction.guild_id)
+                if state.loop:
+                    state.loop = False
+                    button.style = discord.ButtonStyle.red
+                    embed.set_field_at(1, name='Loop', value=':x: Not Looping')
+                else:
+                    state.loop = True
+                    button.style = discord.ButtonStyle.green
+                    embed.set_field_at(1, name='Loop', value=':white_check_mark: Looping')
+                self.bot.states.save(state)
+
+            self.bot.embeds.remember(interaction.guild_id, embed)
+            await interaction.response.edit_message(view=self, embed=embed)
 
-        await interaction.response.edit_message(view=self, embed=embed)
+        future, _ = await submit(self.bot, interaction, 'loop', toggle)
+        if future is not None:
+            await future
 
     @discord.ui.button(label='Stop', style=discord.ButtonStyle.red)
+    @metrics.timed('button', button='stop')
     async def stop_bot_cleanup(self, interaction: discord.Interaction, button: discord.ui.Button):
-        player: wavelink.Player = await get_player(interaction.guild, interaction.user)
-        if player is not None:
-            await player.stop()
-            await player.disconnect()
-            player.queue.clear()
-        await interaction.message.delete()
+        async def stop(count):
+            player: wavelink.Player = await get_player(interaction.guild, interaction.user)
+            if player is not None:
+                await player.stop()
+                await player.disconnect()
+                player.queue.clear()
+            self.bot.embeds.forget(interaction.guild_id)
+            state = self.bot.states.get(interaction.guild_id)
+            state.set_message(None)
+            self.bot.states.save(state)
+            await interaction.message.delete()
+
+        future, merged = await submit(self.bot, interaction, 'stop', stop, merge=True)
+        if future is None:
+            return
+        if merged:
+            return await interaction.response.defer()
+        await future
 
     @discord.ui.select(placeholder='Select Volume', options=[discord.SelectOption(label=f'{item}%') for item in ([item for item in range(10, 110, 10)] + [number for number in range(200, 1100, 100)])])
+    @metrics.timed('button', button='volume')
     async def volume_select(self, interaction: discord.Interaction, select):
-        player: wavelink.Player = await get_player(interaction.guild, interaction.user)
-        if player is not None:
-            percentage = select.values[0].split('%')[0]
-            await player.set_volume(int(percentage))
-        await interaction.response.edit_message(embed=create_embed(self.bot, player, player.track))
+        percentage = select.values[0].split('%')[0]
+
+        async def set_volume(count):
+            # merged selections keep the newest value
+            player: wavelink.Player = await get_player(interaction.guild, interaction.user)
+            if player is not None:
+                await player.set_volume(int(percentage))
+            return player
+
+        future, merged = await submit(self.bot, interaction, 'volume', set_volume, merge=True)
+        if future is None:
+            return
+        if merged:
+            return await interaction.response.defer()
+        player = await future
+        embed = create_embed(self.bot, player, player.track)
+        self.bot.embeds.remember(interaction.guild_id, embed)
+        await interaction.response.edit_message(embed=embed)
+
+
+async def play_entries(bot, interaction: discord.Interaction, entries: list, source: str):
+    # Plays serialized tracks on a deferred interaction, returns the titles
+    # that failed to load, or None after answering when the guild was busy.
+    async def connect(count):
+        if interaction.guild.voice_client is None:
+            return await interaction.user.voice.channel.connect(cls=MusicPlayer), True
+        return interaction.guild.voice_client, False
+
+    loaded = []
+
+    async def add(count):
+        # hands everything resolved so far to the player, returns the track it started
+        tracks = loaded[:]
+        loaded.clear()
+        first = tracks.pop(0) if tracks and not player.is_playing() and player.track is None else None
+        player.queue.extend(tracks)
+        if first is not None:
+            await player.play(first)
+        return first
+
+    async def hand_over():
+        # a refused hand over keeps the tracks for the next one
+        try:
+            future, _ = bot.actors.submit(interaction.guild_id, 'queue_load', add)
+        except Busy:
+            return
+        first = await future
+        if first is None:
+            return
+        if just_connected:
+            embed = create_embed(bot, player, track=first)
+            msg = await interaction.followup.send(embed=embed, view=PlayerView(client=bot, guild=interaction.guild), wait=True)
+            bot.embeds.remember(interaction.guild_id, embed)
+            state = bot.states.get(interaction.guild_id)
+            state.loop = False
+            state.set_message(MessageHandle.from_message(bot, msg))
+            bot.states.save(state)
+        else:
+            bot.embeds.request(interaction.guild)
+
+    future, _ = await submit(bot, interaction, 'queue_load', connect)
+    if future is None:
+        return None
+    player, just_connected = await future
+
+    failed = []
+    concurrency = getattr(config, 'queue_load_concurrency', 5)
+    async for song, track, error in bot.tracks.resolve_many(
+            entries, concurrency=concurrency, resolve=lambda entry: load_entry(bot.tracks, entry)):
+        if error is not None:
+            print(f"Failed to load {song['title']} from {source}: {error}")
+            failed.append(song['title'])
+            continue
+        track.requester = interaction.user.id
+        loaded.append(track)
+        await hand_over()
+    if loaded:
+        await hand_over()
+    # still refused at the end, the guild is too busy for the rest
+    failed.extend(track.title for track in loaded)
+
+    bot.prefetch.schedule(player)
+    bot.embeds.request(interaction.guild)
+    return failed
 
 
 class CustomQueueSelect(discord.ui.Select):
@@ -175,45 +407,32 @@ class CustomQueueSelect(discord.ui.Select):
         options = []
         self.bot = bot
         self.reason = reason
-        if len(bot.custom_queues.cache[str(guild.id)].keys()) > 0:
-            for queue in list(bot.custom_queues.cache[str(guild.id)].keys()):
+        if len(bot.guild_queues(guild.id).keys()) > 0:
+            for queue in list(bot.guild_queues(guild.id).keys()):
                 options.append(discord.SelectOption(label=queue))
             super().__init__(options=options, placeholder="Select a custom Queue")
         else:
             super().__init__(disabled=True, placeholder='You have not yet set custom queues', options=[discord.SelectOption(label='None')])
 
+    @metrics.timed('select', select='custom_queue')
     async def callback(self, interaction: discord.Interaction):
 
         if self.reason == "play":
             try:
-                if interaction.guild.voice_client is None:
-                    player: wavelink.Player = await interaction.user.voice.channel.connect(cls=wavelink.Player)
-                    just_connected = True
-                else:
-
-                    player: wavelink.Player = interaction.guild.voice_client
-                    just_connected = False
-                song_list = []
-                for song in self.bot.custom_queues.cache[str(interaction.guild.id)][self.values[0]]:
-                    song_list.append(await wavelink.YouTubeTrack.search(song, return_first=True))
-                player.queue.extend(song_list)
-                if just_connected:
-                    await player.play(await player.queue.get_wait())
-                    await interaction.response.send_message(content=None, embed=create_embed(self.bot, player, track=player.track or player.queue[0]),
-                                                            view=PlayerView(client=self.bot, guild=interaction.guild))
-                    msg = await interaction.original_message()
-                    self.bot.cache.cache[str(interaction.guild_id)]['loop'] = False
-                    self.bot.cache.cache[str(interaction.guild.id)]['message'] = msg
-                    return
-                else:
-                    if not player.is_playing():
-                        await player.play(await player.queue.get_wait())
-                    msg = self.bot.cache.cache[str(interaction.guild.id)]['message']
-                    embed = create_embed(self.bot, player, track=player.track)
-                    await msg.edit(embed=embed)
-                return await interaction.response.send_message(f"Added {self.values[0]} to queue", ephemeral=True)
+                songs = self.bot.guild_queues(interaction.guild.id)[self.values[0]]
             except KeyError:
                 return await interaction.response.send_message(f"Queue could not be found", ephemeral=True)
+            # resolving can take longer than the interaction token allows for an answer
+            await interaction.response.defer()
+            failed = await play_entries(self.bot, interaction, songs, self.values[0])
+            if failed is None:
+                return
+            # entries that had to be searched were upgraded in place
+            self.bot.custom_queues.mark_dirty(str(interaction.guild.id))
+            content = f"Added {len(songs) - len(failed)} songs from {self.values[0]} to queue"
+            if failed:
+                content += f", could not load: {', '.join(failed)}"
+            return await interaction.followup.send(content, ephemeral=True)
         else:
             await interaction.response.send_modal(AddSongModal( bot=self.bot, queue=self.values[0],))
 
@@ -222,15 +441,26 @@ class MusicalBase(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.bot.embeds = EmbedUpdater(bot, create_embed, window=getattr(config, 'embed_update_window', 1.0))
+        self.bot.actors = GuildActors(max_pending=getattr(config, 'guild_max_pending_operations', 8))
+        self.bot.prefetch = Prefetcher(self.bot.actors, lookahead=getattr(config, 'prefetch_lookahead', 3))
+        self.bot.nodes = NodeManager(bot, getattr(config, 'lavalink_nodes', None),
+                                     check_interval=getattr(config, 'node_check_interval', 5.0))
         self.bot.loop.create_task(self.connect_nodes())
+        self.bot.reaper = PlayerReaper(bot, empty_timeout=getattr(config, 'idle_empty_channel_timeout', 120),
+                                       stopped_timeout=getattr(config, 'idle_stopped_timeout', 300),
+                                       interval=getattr(config, 'idle_check_interval', 15))
+        self.bot.loop.create_task(self.bot.reaper.run())
+        metrics.gauge('active_players', lambda: {(('node', identifier),): len(node_players(node))
+                                                 for identifier, node in self.bot.nodes.nodes.items()})
+        metrics.gauge('loaded_guild_states', lambda: len(self.bot.states))
+        metrics.gauge('embed_updates', lambda: {(('outcome', outcome),): count
+                                                for outcome, count in self.bot.embeds.stats().items()})
+        # the queued track objects by guild, events only carry a rebuilt wavelink.Track
+        self.now_playing: dict = {}
 
     async def connect_nodes(self):
-        await self.bot.wait_until_ready()
-
-        await wavelink.NodePool.create_node(bot=self.bot,
-                                            host='127.0.0.1',
-                                            port=2333,
-                                            password='12345')
+        await self.bot.nodes.connect()
 
     @commands.Cog.listener()
     async def on_wavelink_node_ready(self, node):
@@ -247,69 +477,95 @@ class MusicalBase(commands.Cog):
                 await player.stop()
                 await player.disconnect()
                 player.queue.clear()
+            self.bot.embeds.forget(member.guild.id)
+            self.bot.reaper.forget(member.guild.id)
+            self.now_playing.pop(member.guild.id, None)
 
     @commands.Cog.listener()
+    @metrics.timed('event', event='wavelink_track_start')
+    async def on_wavelink_track_start(self, player: wavelink.Player, track: wavelink.YouTubeTrack):
+        if player.track is not None:
+            self.now_playing[player.guild.id] = player.track
+        self.bot.prefetch.track_started(player.guild.id)
+        self.bot.reaper.touch(player.guild.id)
+        self.bot.history.started(player.guild.id, player.track or track)
+        self.bot.prefetch.schedule(player)
+        self.bot.songs.played(track)
+        save_song_changes(self.bot)
+
+    @commands.Cog.listener()
+    @metrics.timed('event', event='wavelink_track_end')
     async def on_wavelink_track_end(self, player: wavelink.Player, track: wavelink.YouTubeTrack, reason):
-        if not reason == 'REPLACED':
-            if self.bot.cache.cache[str(player.guild.id)]['loop']:
-                return await player.play(track)
+        self.bot.history.record(player.guild.id, track, reason)
+        played = self.now_playing.get(player.guild.id)
+        if played is not None and played.id == track.id:
+            del self.now_playing[player.guild.id]
+        else:
+            played = wavelink.YouTubeTrack(track.id, track.info)
+        if reason == 'REPLACED':
+            return
+        # the gap covers waiting for the actor and looking up the next track too
+        self.bot.prefetch.track_ended(player.guild.id)
+        state = self.bot.states.get(player.guild.id)
+        radio_track = None
+        if state.radio and not state.loop and player.queue.is_empty and not (state.loop_queue and reason == 'FINISHED'):
+            # looked up before joining the actor, button presses behind it must answer within 3 seconds
+            entry = await self.bot.history.radio_pick(player.guild.id)
+            radio_track = await load_entry(self.bot.tracks, entry) if entry is not None else None
+
+        async def advance(count):
+            if not player.is_connected():
+                # stopped through the Stop button while this event waited
+                self.bot.prefetch.stopped(player.guild.id)
+                return
+            if state.loop:
+                return await player.play(played)
+            if state.loop_queue and reason == 'FINISHED':
+                player.queue.put(played)
             if not player.queue.is_empty:
-                new = await player.queue.get_wait()
-                await player.play(new)
+                # the queue was checked ahead of time, play right away
+                await player.play(player.queue.get())
+            elif radio_track is not None and state.radio:
+                await player.play(radio_track)
             else:
-                new = None
+                self.bot.prefetch.stopped(player.guild.id)
                 await player.stop()
-            msg = self.bot.cache.cache[str(player.guild.id)]['message']
-            await msg.edit(embed=create_embed(bot=self.bot, player=player, track=new))
+            self.bot.embeds.request(player.guild)
+
+        # queued behind button presses so both never touch the player at once
+        await self.bot.actors.run(player.guild.id, 'track_end', advance)
 
     async def search_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-        songs = [app_commands.Choice(name=song, value=song) for song in self.bot.cache.cache['known_songs'] if current.lower() in song.lower()]
-        if len(songs) >= 25:
-            return songs[:25]
-        return songs
+        # songs this guild played to the end most often come first
+        counts = await self.bot.history.play_counts(interaction.guild_id)
+        if not counts:
+            songs = self.bot.songs.search(current, limit=25)
+        else:
+            top = self.bot.history.top_titles(interaction.guild_id, getattr(config, 'autocomplete_boost_seed', 200))
+            songs = self.bot.songs.search(current, limit=25, boost=counts.__getitem__, seed=top)
+        return [app_commands.Choice(name=song, value=song) for song in songs]
 
-    @app_commands.command(name='play', description='Starts a music session in your current voice chat.')
+    @app_commands.command(name='play', description='Play songs in your voice chat, separate several searches with ; or paste a playlist link.')
     @app_commands.autocomplete(search=search_autocomplete)
+    @metrics.timed('command', command='play')
     async def _play(self, interaction: discord.Interaction, search: str):
-        search = await wavelink.YouTubeTrack.search(search, return_first=True)
-        add_song_to_song_list(self.bot, interaction.guild, search)
-        if interaction.user.voice.channel is None:
-            return interaction.response.send_message(content='You are not in a voice channel', ephemeral=True)
-
-        if not interaction.guild.voice_client:
-            player: wavelink.Player = await interaction.user.voice.channel.connect(cls=wavelink.Player)
-        else:
-            player: wavelink.Player = interaction.guild.voice_client
-            if not player.is_playing():
-                await player.play(search)
-                msg = self.bot.cache.cache[str(interaction.guild.id)]['message']
-                await msg.edit(embed=create_embed(self.bot, player, player.track or search))
-                return await interaction.response.send_message(f"Resumed Playback with {search.title}", ephemeral=True)
-        if not player.is_playing():
-            await player.play(search)
-            await interaction.response.send_message(content=None,
-                                                    embed=create_embed(bot=self.bot, player=player, track=player.track or search),
-                                                    view=PlayerView(client=self.bot, guild=interaction.guild))
-            msg = await interaction.original_message()
-            self.bot.cache.cache[str(interaction.guild_id)]['loop'] = False
-            self.bot.cache.cache[str(interaction.guild.id)]['message'] = msg
-            print(self.bot.cache.cache[str(interaction.guild.id)])
-            return
-        else:
-            msg = self.bot.cache.cache[str(interaction.guild.id)]['message']
-            if player.track is not None:
-                player.queue.put(search)
-            else:
-                await player.play(search)
-            await msg.edit(embed=create_embed(self.bot, player, track=player.track or search))
-            return await interaction.response.send_message(f"Added {search.title} to queue", ephemeral=True)
+        if interaction.user.voice is None:
+            return await interaction.response.send_message(content='You are not in a voice channel', ephemeral=True)
+        error = too_many_queries(search)
+        if error is not None:
+            return await interaction.response.send_message(error, ephemeral=True)
+        # a new session answers with the player message, anything else only acknowledges
+        await interaction.response.defer(ephemeral=interaction.guild.voice_client is not None)
+        await enqueue(self.bot, interaction, search)
 
     @app_commands.command()
+    @metrics.timed('command', command='self_sync')
     async def self_sync(self, interaction):
-        await self.bot.tree.sync()
+        await self.bot.sync_commands(force=True)
         return await interaction.response.send_message(':white_check_mark:')
 
     @app_commands.command(name="skip_to", description="Skip to a defined position in the song, use a MINUTE:SECOND format.")
+    @metrics.timed('command', command='skip_to')
     async def _skip_to(self, interaction, place: str):
         place = get_time(place)
         player: wavelink.Player = await get_player(interaction.guild, interaction.user)
@@ -319,6 +575,7 @@ class MusicalBase(commands.Cog):
         await interaction.response.send_message(f'Skipped to {place[0]}:{place[1]}', ephemeral=True)
 
     @app_commands.command(name='forward', description='Skip forwards 10 seconds by default or a custom amount of seconds')
+    @metrics.timed('command', command='forward')
     async def _forward(self, interaction, time: int = 10):
         player: wavelink.Player = interaction.guild.voice_client
         if not player.is_connected() or not player.is_playing():
@@ -329,6 +586,7 @@ class MusicalBase(commands.Cog):
         await interaction.response.send_message(f'Skipped {time} seconds', ephemeral=True)
 
     @app_commands.command(name='volume', description='Set the players\' Volume.')
+    @metrics.timed('command', command='volume')
     async def _volume(self, interaction, volume: int):
         player: wavelink.Player = await get_player(interaction.guild, interaction.user)
         if not player.is_connected():
@@ -337,6 +595,7 @@ class MusicalBase(commands.Cog):
         await interaction.response.send_message(f'Set volume to {volume}%.', ephemeral=True)
 
     @app_commands.command(name='position', description='Get the current song position.')
+    @metrics.timed('command', command='position')
     async def _position(self, interaction):
         player: wavelink.Player = await get_player(interaction.guild, interaction.user)
         if player is not None:
@@ -344,32 +603,183 @@ class MusicalBase(commands.Cog):
             return await interaction.response.send_message(f'The current position is {time}')
 
     @app_commands.command(name='queue', description='Retrieve the current active queue')
-    async def _queue(self, interaction: discord.Interaction):
-        pass  # TODO add a queue retrieval
+    @metrics.timed('command', command='queue')
+    async def _queue(self, interaction: discord.Interaction, page: int = 1):
+        player: wavelink.Player = interaction.guild.voice_client
+        if player is None:
+            return await interaction.response.send_message('The bot is not playing anything.', ephemeral=True)
+        await interaction.response.send_message(embed=create_queue_embed(player, page), ephemeral=True)
+
+    @app_commands.command(name='move', description='Move a track in the queue to another position.')
+    @metrics.timed('command', command='move')
+    async def _move(self, interaction: discord.Interaction, position: int, to: int):
+        async def move(count):
+            player: wavelink.Player = interaction.guild.voice_client
+            if player is None or not 1 <= position <= len(player.queue) or not 1 <= to <= len(player.queue):
+                return None
+            track = player.queue[position - 1]
+            player.queue.move(position - 1, to - 1)
+            return track
+
+        future, _ = await submit(self.bot, interaction, 'move', move)
+        if future is None:
+            return
+        track = await future
+        if track is None:
+            return await interaction.response.send_message('There is no track at that position.', ephemeral=True)
+        self.bot.embeds.request(interaction.guild)
+        await interaction.response.send_message(f'Moved {track.title} to position {to}', ephemeral=True)
+
+    @app_commands.command(name='remove', description='Remove a track from the queue.')
+    @metrics.timed('command', command='remove')
+    async def _remove(self, interaction: discord.Interaction, position: int):
+        async def remove(count):
+            player: wavelink.Player = interaction.guild.voice_client
+            if player is None or not 1 <= position <= len(player.queue):
+                return None
+            return player.queue.remove_at(position - 1)
+
+        future, _ = await submit(self.bot, interaction, 'remove', remove)
+        if future is None:
+            return
+        track = await future
+        if track is None:
+            return await interaction.response.send_message('There is no track at that position.', ephemeral=True)
+        self.bot.embeds.request(interaction.guild)
+        await interaction.response.send_message(f'Removed {track.title} from the queue', ephemeral=True)
+
+    @app_commands.command(name='shuffle', description='Shuffle the queue.')
+    @metrics.timed('command', command='shuffle')
+    async def _shuffle(self, interaction: discord.Interaction):
+        async def shuffle(count):
+            player: wavelink.Player = interaction.guild.voice_client
+            if player is None or player.queue.is_empty:
+                return None
+            player.queue.shuffle()
+            return player
+
+        future, _ = await submit(self.bot, interaction, 'shuffle', shuffle)
+        if future is None:
+            return
+        player = await future
+        if player is None:
+            return await interaction.response.send_message('The queue is empty.', ephemeral=True)
+        self.bot.embeds.request(interaction.guild)
+        self.bot.prefetch.schedule(player)
+        await interaction.response.send_message('Shuffled the queue', ephemeral=True)
+
+    @app_commands.command(name='loop_queue', description='Toggle putting finished tracks back at the end of the queue.')
+    @metrics.timed('command', command='loop_queue')
+    async def _loop_queue(self, interaction: discord.Interaction):
+        state = self.bot.states.get(interaction.guild_id)
+        state.loop_queue = not state.loop_queue
+        self.bot.states.save(state)
+        self.bot.embeds.request(interaction.guild)
+        await interaction.response.send_message(':white_check_mark: Looping queue' if state.loop_queue else ':x: Not looping queue',
+                                                ephemeral=True)
 
     @app_commands.command(name='custom_queue', description='Make a custom saved queue of the current player queue.')
+    @metrics.timed('command', command='custom_queue')
     async def _custom_queue_maker(self, interaction: discord.Interaction, name: str):
         queue = []
         player: wavelink.Player = await get_player(interaction.guild, interaction.user)
         for song in player.queue:
-            queue.append(song.title)
-        self.bot.custom_queues.cache[str(interaction.guild.id)][name] = queue
+            queue.append(serialize_track(song))
+        self.bot.guild_queues(interaction.guild.id)[name] = queue
+        self.bot.custom_queues.mark_dirty(str(interaction.guild.id))
+        return await interaction.response.send_message(f'Saved {len(queue)} songs as {name}', ephemeral=True)
 
     @app_commands.command(name='play_queue', description='Play a saved custom queue.')
+    @metrics.timed('command', command='play_queue')
     async def _play_queue(self, interaction):
         view = discord.ui.View(timeout=None)
         view.add_item(CustomQueueSelect(self.bot, interaction.guild, "play"))
         print(view.children)
         return await interaction.response.send_message(content='Select a queue to add to the current queue', view=view, ephemeral=True)
 
+    @app_commands.command(name='resume', description='Restore the queue of a player that was disconnected while idle.')
+    @metrics.timed('command', command='resume')
+    async def _resume(self, interaction: discord.Interaction):
+        state = self.bot.states.get(interaction.guild_id)
+        if not state.saved_queue:
+            return await interaction.response.send_message('There is no saved queue to resume.', ephemeral=True)
+        if interaction.user.voice is None:
+            return await interaction.response.send_message('You are not in a voice channel', ephemeral=True)
+        await interaction.response.defer()
+        songs, state.saved_queue = state.saved_queue, None
+        self.bot.states.save(state)
+        failed = await play_entries(self.bot, interaction, songs, 'the saved queue')
+        if failed is None:
+            # kept for the next /resume
+            state.saved_queue = songs
+            self.bot.states.save(state)
+            return
+        content = f"Resumed {len(songs) - len(failed)} songs"
+        if failed:
+            content += f", could not load: {', '.join(failed)}"
+        return await interaction.followup.send(content, ephemeral=True)
+
+    @app_commands.command(name='top', description='Show the most played songs of this server.')
+    @metrics.timed('command', command='top')
+    async def _top(self, interaction: discord.Interaction, days: int = None, count: int = 10):
+        rows = await self.bot.history.top(interaction.guild_id, limit=max(1, min(count, 25)), days=days)
+        if not rows:
+            return await interaction.response.send_message('Nothing has been played yet.', ephemeral=True)
+        embed = discord.Embed(title=f'Most played in the last {days} days' if days else 'Most played')
+        for position, (title, plays) in enumerate(rows, start=1):
+            embed.add_field(name=position, value=f'{title} - {plays} plays', inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name='recent', description='Show the songs played last on this server.')
+    @metrics.timed('command', command='recent')
+    async def _recent(self, interaction: discord.Interaction, count: int = 10):
+        rows = await self.bot.history.recent(interaction.guild_id, limit=max(1, min(count, 25)))
+        if not rows:
+            return await interaction.response.send_message('Nothing has been played yet.', ephemeral=True)
+        embed = discord.Embed(title='Recently played')
+        for title, requester, ts, played, reason in rows:
+            requested = f' - requested by <@{requester}>' if requester else ''
+            embed.add_field(name=title, value=f'<t:{ts}:R>, {reason} after {format_length(played)}{requested}', inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name='radio', description='Toggle playing songs from this server\'s history when the queue runs out.')
+    @metrics.timed('command', command='radio')
+    async def _radio(self, interaction: discord.Interaction):
+        state = self.bot.states.get(interaction.guild_id)
+        state.radio = not state.radio
+        self.bot.states.save(state)
+        await interaction.response.send_message(':white_check_mark: Radio on' if state.radio else ':x: Radio off',
+                                                ephemeral=True)
+
+    @app_commands.command(name='cache_stats', description='Show how many searches the track cache saved.')
+    @metrics.timed('command', command='cache_stats')
+    async def _cache_stats(self, interaction: discord.Interaction):
+        stats = self.bot.tracks.stats()
+        return await interaction.response.send_message(
+            f"{stats['entries']} cached tracks, {stats['hits']} hits, {stats['coalesced']} coalesced, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%} saved)", ephemeral=True)
+
+    @app_commands.command(name='profile', description='Sample the event loop for a few seconds (owner only).')
+    async def _profile(self, interaction: discord.Interaction, seconds: int = 10):
+        if not await self.bot.is_owner(interaction.user):
+            return await interaction.response.send_message('Only the bot owner can profile the bot.', ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        profiler = SamplingProfiler()
+        profiler.start()
+        await asyncio.sleep(max(1, min(seconds, 60)))
+        top = profiler.stop()
+        total = sum(profiler.samples.values()) or 1
+        lines = [f'{count * 100 / total:5.1f}% {stack}' for stack, count in top]
+        await interaction.followup.send('```\n' + '\n'.join(lines)[:1900] + '\n```', ephemeral=True)
+
    # @app_commands.command(name='manage_queues'
     @app_commands.command()
+    @metrics.timed('command', command='save')
     async def save(self, interaction):
-        self.bot.cache.save()
-        self.bot.custom_queues.save()
-        print('reached')
-        await self.bot.tree.sync()
-        print('second reach')
+        await self.bot.cache.flush()
+        await self.bot.custom_queues.flush()
+        await self.bot.tracks.flush()
+        await self.bot.history.flush()
         await interaction.response.send_message('Saved', ephemeral=True)
 
 
@@ -380,6 +790,7 @@ class ManageQueue(app_commands.Group):
         super().__init__()
 
     @app_commands.command(name='add', description='Add a song to a custom Queue')
+    @metrics.timed('command', command='manage_queue_add')
     async def add_song_to_queue(self, interaction: discord.Interaction):
         view = discord.ui.View(timeout=None)
         view.add_item(CustomQueueSelect(self.bot, interaction.guild, "add"))
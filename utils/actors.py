@@ -0,0 +1,78 @@
+import asyncio
+from collections import deque
+
+from utils.metrics import metrics
+
+
+class Busy(Exception):
+    pass
+
+
+class _Operation:
+    __slots__ = ('kind', 'run', 'count', 'future')
+
+    def __init__(self, kind: str, run):
+        self.kind = kind
+        self.run = run
+        self.count = 1
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class GuildActors:
+    # Runs the player operations of a guild one at a time, in the order they
+    # were submitted. A mergeable operation submitted while the same kind is
+    # still waiting at the tail joins it instead, its `run` is called once
+    # with how often it was requested (five skips become one skip of five).
+    # Guilds with `max_pending` operations waiting are refused with Busy.
+
+    def __init__(self, max_pending: int = 8):
+        self.max_pending = max_pending
+        self.merged = 0
+        self.shed = 0
+        self._pending: dict = {}
+        self._workers: dict = {}
+
+    def pending(self, guild_id: int) -> int:
+        return len(self._pending.get(guild_id, ()))
+
+    def submit(self, guild_id: int, kind: str, run, merge: bool = False, bounded: bool = True) -> tuple:
+        # Returns (future, merged). `run` is awaited as run(count); a merged
+        # submission replaces it, so the newest arguments win.
+        pending = self._pending.setdefault(guild_id, deque())
+        if merge and pending and pending[-1].kind == kind:
+            operation = pending[-1]
+            operation.count += 1
+            operation.run = run
+            self.merged += 1
+            metrics.increment('actor_merged', kind=kind)
+            return operation.future, True
+        if bounded and len(pending) >= self.max_pending:
+            self.shed += 1
+            metrics.increment('actor_shed', kind=kind)
+            raise Busy(f'{len(pending)} operations are already waiting in {guild_id}')
+        operation = _Operation(kind, run)
+        pending.append(operation)
+        worker = self._workers.get(guild_id)
+        if worker is None or worker.done():
+            self._workers[guild_id] = asyncio.get_running_loop().create_task(self._work(guild_id, pending))
+        return operation.future, False
+
+    async def run(self, guild_id: int, kind: str, run):
+        # for events, they are never merged or refused
+        future, _ = self.submit(guild_id, kind, run, bounded=False)
+        return await future
+
+    async def _work(self, guild_id: int, pending: deque):
+        while pending:
+            operation = pending.popleft()
+            try:
+                with metrics.timer('actor_operation', kind=operation.kind):
+                    result = await operation.run(operation.count)
+            except Exception as e:
+                if not operation.future.done():
+                    operation.future.set_exception(e)
+            else:
+                if not operation.future.done():
+                    operation.future.set_result(result)
+        self._pending.pop(guild_id, None)
+        self._workers.pop(guild_id, None)
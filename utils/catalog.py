@@ -0,0 +1,138 @@
+import time
+from collections import OrderedDict
+
+from utils.search import SearchIndex
+from utils.sharding import GLOBAL_KEYS
+from utils.store import StoredCache
+
+
+class SongCatalog:
+    # Every title the bot has resolved, in the order it was first seen.
+    # Stored in data.json as the plain 'known_songs' title list plus a
+    # 'song_metadata' mapping, so older files load unchanged.
+
+    def __init__(self, limit: int = 10000, policy: str = 'lru'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'Unknown eviction policy {policy}')
+        self.limit = limit
+        self.policy = policy
+        self.index = SearchIndex()
+        self._songs: dict = {}
+        self._recency: OrderedDict = OrderedDict()
+        # titles changed since the last take_changes() and whether any were added or removed
+        self._changed: set = set()
+        self._resized = False
+
+    @classmethod
+    def from_data(cls, data: dict, limit: int = 10000, policy: str = 'lru'):
+        catalog = cls(limit=limit, policy=policy)
+        metadata = data.get('song_metadata', {})
+        for title in data.get('known_songs', []):
+            catalog._insert(title, metadata.get(title, {}))
+        # songs played most recently are the last to be evicted
+        for title in sorted(catalog._songs, key=lambda title: catalog._songs[title]['last_played'] or 0):
+            catalog._recency.move_to_end(title)
+        catalog._evict()
+        return catalog
+
+    def to_data(self, data: dict):
+        data['known_songs'] = list(self._songs)
+        data['song_metadata'] = self._songs
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def __contains__(self, title) -> bool:
+        return title in self._songs
+
+    def __iter__(self):
+        return iter(self._songs)
+
+    def get(self, title: str):
+        return self._songs.get(title)
+
+    def add(self, track) -> bool:
+        if track.title in self._songs:
+            self._update(track)
+            return False
+        self._insert(track.title, {})
+        self._update(track)
+        self._evict()
+        return True
+
+    def played(self, track):
+        if track.title not in self._songs:
+            self._insert(track.title, {})
+        entry = self._update(track)
+        entry['plays'] += 1
+        entry['last_played'] = int(time.time())
+        self._evict()
+
+    def take_changes(self) -> tuple:
+        changed, resized = self._changed, self._resized
+        self._changed, self._resized = set(), False
+        return changed, resized
+
+    def search(self, query: str, limit: int = 25, boost=None, seed=()) -> list:
+        return self.index.search(query, limit=limit, boost=boost, seed=seed)
+
+    def _insert(self, title: str, metadata: dict):
+        self._songs[title] = {
+            'uri': metadata.get('uri'),
+            'author': metadata.get('author'),
+            'duration': metadata.get('duration'),
+            'plays': metadata.get('plays', 0),
+            'last_played': metadata.get('last_played'),
+        }
+        self._recency[title] = None
+        self.index.add(title)
+        self._changed.add(title)
+        self._resized = True
+
+    def _update(self, track) -> dict:
+        entry = self._songs[track.title]
+        entry['uri'] = getattr(track, 'uri', None) or entry['uri']
+        entry['author'] = getattr(track, 'author', None) or entry['author']
+        entry['duration'] = getattr(track, 'duration', None) or entry['duration']
+        self._recency.move_to_end(track.title)
+        self._changed.add(track.title)
+        return entry
+
+    def _evict(self):
+        if len(self._songs) <= self.limit:
+            return
+        if self.policy == 'lru':
+            while len(self._songs) > self.limit:
+                self._remove(self._recency.popitem(last=False)[0])
+        else:
+            # evict a batch at once so the frequency scan is not paid on every add
+            excess = len(self._songs) - self.limit + max(1, self.limit // 20)
+            recent = list(self._recency)[-1:]
+            ranked = sorted(self._recency, key=lambda title: self._songs[title]['plays'])
+            for title in [title for title in ranked if title not in recent][:excess]:
+                del self._recency[title]
+                self._remove(title)
+
+    def _remove(self, title: str):
+        del self._songs[title]
+        self.index.remove(title)
+        self._changed.add(title)
+        self._resized = True
+
+
+class MusicCache(StoredCache):
+    # data.json. Guild entries are loaded on demand, the global keys are
+    # needed at startup. 'known_songs' is written from `songs` once the
+    # catalog has been built from the loaded data.
+
+    def __init__(self, path: str, backend: str = 'json', delay: float = 5.0):
+        super().__init__(path, backend=backend, delay=delay)
+        self.songs = None
+
+    def load(self, eager=GLOBAL_KEYS):
+        super().load(eager=eager)
+
+    def encode(self, key: str, value):
+        if key == 'known_songs' and self.songs is not None:
+            return list(self.songs)
+        return value
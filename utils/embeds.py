@@ -0,0 +1,73 @@
+import asyncio
+
+import discord
+
+from utils.metrics import metrics
+
+
+class EmbedUpdater:
+    # Collects now playing embed updates per guild. A request marks the
+    # guild dirty, the embed is rendered once after `window` seconds and only
+    # edited if it differs from what the message already shows.
+
+    def __init__(self, bot, render, window: float = 1.0):
+        self.bot = bot
+        self.render = render
+        self.window = window
+        self.requested = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.edits = 0
+        self._pending: dict = {}
+        self._shown: dict = {}
+
+    def stats(self) -> dict:
+        return {'requested': self.requested, 'coalesced': self.coalesced, 'unchanged': self.unchanged, 'edits': self.edits}
+
+    def request(self, guild: discord.Guild):
+        self.requested += 1
+        task = self._pending.get(guild.id)
+        if task is not None and not task.done():
+            self.coalesced += 1
+            return
+        self._pending[guild.id] = asyncio.get_running_loop().create_task(self._flush_later(guild))
+
+    def remember(self, guild_id: int, embed: discord.Embed):
+        # the embed was sent through another path, e.g. an interaction response
+        self._shown[guild_id] = embed.to_dict()
+
+    def forget(self, guild_id: int):
+        task = self._pending.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+        self._shown.pop(guild_id, None)
+
+    async def _flush_later(self, guild: discord.Guild):
+        await asyncio.sleep(self.window)
+        self._pending.pop(guild.id, None)
+        await self.flush(guild)
+
+    async def flush(self, guild: discord.Guild):
+        msg = self.bot.states.get(guild.id).message
+        if msg is None:
+            return
+        player = guild.voice_client
+        embed = self.render(self.bot, player, player.track if player is not None else None)
+        content = embed.to_dict()
+        if self._shown.get(guild.id) == content:
+            self.unchanged += 1
+            return
+        try:
+            with metrics.timer('embed_edit'):
+                await msg.edit(embed=embed)
+        except discord.NotFound:
+            # the player message was deleted, stop tracking it
+            state = self.bot.states.get(guild.id)
+            state.set_message(None)
+            self.bot.states.save(state)
+            return
+        except discord.HTTPException as e:
+            print(f'Failed to update the player message in {guild.id}: {e}')
+            return
+        self._shown[guild.id] = content
+        self.edits += 1
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from utils.metrics import metrics
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS plays (
+    guild_id INTEGER NOT NULL,
+    track_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    requester INTEGER,
+    ts INTEGER NOT NULL,
+    played REAL NOT NULL,
+    reason TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plays_guild_ts ON plays (guild_id, ts);
+CREATE TABLE IF NOT EXISTS track_stats (
+    guild_id INTEGER NOT NULL,
+    track_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    track TEXT,
+    uri TEXT,
+    author TEXT,
+    duration REAL,
+    plays INTEGER NOT NULL DEFAULT 0,
+    skips INTEGER NOT NULL DEFAULT 0,
+    played REAL NOT NULL DEFAULT 0,
+    last_played INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, track_id)
+);
+CREATE INDEX IF NOT EXISTS track_stats_plays ON track_stats (guild_id, plays);
+CREATE TABLE IF NOT EXISTS daily_plays (
+    guild_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    track_id TEXT NOT NULL,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, day, track_id)
+);
+'''
+
+DAY = 24 * 60 * 60
+
+
+class PlayHistory:
+    # Append-only log of every track that stopped playing, in SQLite. Plays
+    # are buffered and written in batches from a worker thread, in the same
+    # transaction as the all-time `track_stats` and per-day `daily_plays`
+    # aggregates, so /top never scans the log. Play counts per guild are
+    # also kept in memory for autocomplete ranking once a guild asked for them.
+
+    def __init__(self, path: str, delay: float = 5.0, batch: int = 200):
+        self.path = path
+        self.delay = delay
+        self.batch = batch
+        self.written = 0
+        self._buffer: list = []
+        self._counts: dict = {}
+        self._top: dict = {}
+        self._started: dict = {}
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        self._write_lock = threading.Lock()
+        self._db = None
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def started(self, guild_id: int, track):
+        # the track the player started, event tracks are rebuilt without the requester
+        self._started[guild_id] = (track_key(track), time.monotonic(), getattr(track, 'requester', None))
+
+    def record(self, guild_id: int, track, reason: str):
+        key = track_key(track)
+        started = self._started.pop(guild_id, None)
+        if started is None or started[0] != key:
+            started = (key, time.monotonic(), None)
+        played = time.monotonic() - started[1]
+        if track.duration:
+            played = min(played, track.duration)
+        self._buffer.append((guild_id, key, track.title, started[2], int(time.time()),
+                             played, reason.lower(), track.id, track.uri, track.author, track.duration))
+        counts = self._counts.get(guild_id)
+        if counts is not None and reason == 'FINISHED':
+            counts[track.title] += 1
+            self._top.pop(guild_id, None)
+        metrics.increment('plays_logged', reason=reason.lower())
+        if len(self._buffer) >= self.batch:
+            asyncio.get_running_loop().create_task(self.flush())
+        elif self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._debounce())
+
+    async def play_counts(self, guild_id: int) -> Counter:
+        # finished plays per title, read once per guild and then kept up to date
+        counts = self._counts.get(guild_id)
+        if counts is not None:
+            return counts
+        # no flush can move buffered plays into the table while it is read
+        async with self._flush_lock:
+            counts = self._counts.get(guild_id)
+            if counts is None:
+                rows = await asyncio.to_thread(self._read, 'SELECT title, plays FROM track_stats WHERE guild_id = ?',
+                                               (guild_id,))
+                counts = Counter()
+                for title, plays in rows:
+                    counts[title] += plays
+                counts.update(row[2] for row in self._buffer if row[0] == guild_id and row[6] == 'finished')
+                self._counts[guild_id] = counts
+        return counts
+
+    def top_titles(self, guild_id: int, limit: int = 200) -> list:
+        # the guild's most finished titles, from the loaded counts, until the next finished play
+        top = self._top.get(guild_id)
+        if top is None:
+            counts = self._counts.get(guild_id)
+            top = self._top[guild_id] = [title for title, _ in counts.most_common(limit)] if counts else []
+        return top
+
+    def release(self, guild_id: int):
+        self._counts.pop(guild_id, None)
+        self._top.pop(guild_id, None)
+        self._started.pop(guild_id, None)
+
+    async def top(self, guild_id: int, limit: int = 10, days: int = None) -> list:
+        # [(title, plays)], all time from track_stats or summed from the daily buckets
+        await self.flush()
+        if days is None:
+            query = ('SELECT title, plays FROM track_stats WHERE guild_id = ? AND plays > 0 '
+                     'ORDER BY plays DESC LIMIT ?')
+            return await asyncio.to_thread(self._read, query, (guild_id, limit))
+        query = ('SELECT track_stats.title, SUM(daily_plays.plays) AS total FROM daily_plays '
+                 'JOIN track_stats USING (guild_id, track_id) WHERE daily_plays.guild_id = ? AND day >= ? '
+                 'GROUP BY daily_plays.track_id ORDER BY total DESC LIMIT ?')
+        return await asyncio.to_thread(self._read, query, (guild_id, int(time.time()) // DAY - days + 1, limit))
+
+    async def recent(self, guild_id: int, limit: int = 10) -> list:
+        # [(title, requester, ts, played, reason)], newest first
+        await self.flush()
+        query = ('SELECT title, requester, ts, played, reason FROM plays WHERE guild_id = ? '
+                 'ORDER BY ts DESC, rowid DESC LIMIT ?')
+        return await asyncio.to_thread(self._read, query, (guild_id, limit))
+
+    async def radio_pick(self, guild_id: int, avoid: int = 20, pool: int = 50):
+        # A serialized track entry picked from the guild's most played tracks,
+        # weighted by plays and skipping the `avoid` most recently played.
+        await self.flush()
+        recent = {row[0] for row in await asyncio.to_thread(
+            self._read, 'SELECT track_id FROM plays WHERE guild_id = ? ORDER BY ts DESC, rowid DESC LIMIT ?',
+            (guild_id, avoid))}
+        rows = await asyncio.to_thread(
+            self._read, 'SELECT track_id, title, track, uri, author, duration, plays FROM track_stats '
+                        'WHERE guild_id = ? AND plays > 0 ORDER BY plays DESC LIMIT ?', (guild_id, pool))
+        rows = [row for row in rows if row[0] not in recent] or rows
+        if not rows:
+            return None
+        _, title, track, uri, author, duration, _ = random.choices(rows, weights=[row[6] for row in rows])[0]
+        return {'title': title, 'track': track, 'uri': uri, 'author': author, 'duration': duration}
+
+    async def _debounce(self):
+        # plays recorded during a flush are picked up by the next round
+        while self._buffer:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._buffer:
+                rows, self._buffer = self._buffer, []
+                with metrics.timer('persistence_write', file=os.path.basename(self.path)):
+                    await asyncio.to_thread(self._write, rows)
+
+    def flush_sync(self):
+        if self._buffer and self._db is not None:
+            rows, self._buffer = self._buffer, []
+            self._write(rows)
+
+    def _read(self, query: str, parameters: tuple) -> list:
+        with self._write_lock:
+            return self._db.execute(query, parameters).fetchall()
+
+    def _write(self, rows: list):
+        with self._write_lock, self._db:
+            self._db.executemany('INSERT INTO plays (guild_id, track_id, title, requester, ts, played, reason) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)', [row[:7] for row in rows])
+            self._db.executemany(
+                'INSERT INTO track_stats (guild_id, track_id, title, track, uri, author, duration, plays, skips, '
+                'played, last_played) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(guild_id, track_id) DO UPDATE SET title = excluded.title, track = excluded.track, '
+                'plays = plays + excluded.plays, skips = skips + excluded.skips, '
+                'played = played + excluded.played, last_played = excluded.last_played',
+                [(guild_id, key, title, track, uri, author, duration, int(reason == 'finished'),
+                  int(reason != 'finished'), played, ts)
+                 for guild_id, key, title, _, ts, played, reason, track, uri, author, duration in rows])
+            self._db.executemany(
+                'INSERT INTO daily_plays (guild_id, day, track_id, plays) VALUES (?, ?, ?, 1) '
+                'ON CONFLICT(guild_id, day, track_id) DO UPDATE SET plays = plays + 1',
+                [(row[0], row[4] // DAY, row[1]) for row in rows if row[6] == 'finished'])
+        self.written += len(rows)
+
+
+def track_key(track) -> str:
+    return track.identifier or track.uri or track.title
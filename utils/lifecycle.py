@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import Counter
+
+import discord
+
+from utils.metrics import metrics
+from utils.nodes import node_players
+from utils.tracks import serialize_track
+
+
+def listener_count(player) -> int:
+    channel = getattr(player, 'channel', None)
+    if channel is None:
+        return 0
+    return sum(1 for member in channel.members if not member.bot)
+
+
+class PlayerReaper:
+    # Disconnects players nobody is listening to: alone in their channel for
+    # `empty_timeout` seconds, or not playing anything for `stopped_timeout`
+    # seconds. The queue is kept in the guild state so /resume can restore it.
+
+    def __init__(self, bot, empty_timeout: float = 120, stopped_timeout: float = 300, interval: float = 15):
+        self.bot = bot
+        self.empty_timeout = empty_timeout
+        self.stopped_timeout = stopped_timeout
+        self.interval = interval
+        self.reclaimed = Counter()
+        self._last_active: dict = {}
+        self._empty_since: dict = {}
+
+    def touch(self, guild_id: int):
+        self._last_active[guild_id] = time.monotonic()
+
+    def forget(self, guild_id: int):
+        self._last_active.pop(guild_id, None)
+        self._empty_since.pop(guild_id, None)
+
+    def players(self) -> list:
+        return [player for node in self.bot.nodes.nodes.values() for player in node_players(node)]
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f'Reaping idle players failed: {e}')
+
+    async def sweep(self):
+        now = time.monotonic()
+        for player in self.players():
+            if self.idle_reason(player, now) is not None:
+                # waits for button presses already queued for the player
+                await self.bot.actors.run(player.guild.id, 'reap', lambda count: self.reap(player))
+
+    def idle_reason(self, player, now: float):
+        guild_id = player.guild.id
+        if listener_count(player):
+            self._empty_since.pop(guild_id, None)
+        else:
+            self._empty_since.setdefault(guild_id, now)
+        if player.is_playing():
+            self.touch(guild_id)
+        last_active = self._last_active.setdefault(guild_id, now)
+        if now - self._empty_since.get(guild_id, now) >= self.empty_timeout:
+            return 'empty_channel'
+        if now - last_active >= self.stopped_timeout:
+            return 'stopped'
+        return None
+
+    async def reap(self, player):
+        # the queued operations ahead of this one may have made the guild active again
+        if not player.is_connected() or player.guild.voice_client is not player:
+            return
+        reason = self.idle_reason(player, time.monotonic())
+        if reason is None:
+            return
+        guild = player.guild
+        state = self.bot.states.get(guild.id)
+        tracks = ([player.track] if player.track is not None else []) + list(player.queue)
+        if tracks:
+            state.saved_queue = [serialize_track(track) for track in tracks]
+        player.queue.clear()
+        await player.stop()
+        await player.disconnect()
+        self.forget(guild.id)
+        self.bot.embeds.forget(guild.id)
+        self.reclaimed['players'] += 1
+        metrics.increment('reclaimed_players', reason=reason)
+        if state.message is not None:
+            # deleting the message also drops its PlayerView from the view store
+            try:
+                await state.message.delete()
+                self.reclaimed['views'] += 1
+                metrics.increment('reclaimed_views')
+            except discord.HTTPException:
+                pass
+            state.set_message(None)
+        self.bot.states.save(state)
+        print(f'Disconnected idle player in {guild.id} ({reason}), saved {len(tracks)} tracks for /resume, '
+              f'reclaimed {self.reclaimed["players"]} players and {self.reclaimed["views"]} views so far')
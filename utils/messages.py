@@ -0,0 +1,48 @@
+import discord
+
+
+class MessageHandle:
+    # Points at a message by channel and message id. Edits go through a
+    # PartialMessage, which needs no REST call to build; the full message is
+    # only fetched after an edit through the partial one failed.
+    __slots__ = ('client', 'channel_id', 'message_id', '_message', 'refetches')
+
+    def __init__(self, client: discord.Client, channel_id: int, message_id: int, message=None):
+        self.client = client
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self._message = message
+        self.refetches = 0
+
+    @classmethod
+    def from_message(cls, client: discord.Client, message):
+        return cls(client, message.channel.id, message.id)
+
+    @property
+    def id(self) -> int:
+        return self.message_id
+
+    @property
+    def message(self):
+        if self._message is None:
+            channel = self.client.get_partial_messageable(self.channel_id)
+            self._message = channel.get_partial_message(self.message_id)
+        return self._message
+
+    async def refetch(self):
+        self.refetches += 1
+        channel = self.client.get_channel(self.channel_id) or await self.client.fetch_channel(self.channel_id)
+        self._message = await channel.fetch_message(self.message_id)
+        return self._message
+
+    async def edit(self, **kwargs):
+        try:
+            return await self.message.edit(**kwargs)
+        except discord.NotFound:
+            raise
+        except discord.HTTPException:
+            message = await self.refetch()
+            return await message.edit(**kwargs)
+
+    async def delete(self):
+        await self.message.delete()
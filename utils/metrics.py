@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from aiohttp import web
+
+
+class Summary:
+    __slots__ = ('samples', 'count', 'total')
+
+    def __init__(self, size: int = 1024):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _format(name: str, labels: tuple, extra: dict = None) -> str:
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class Metrics:
+    # Process wide timings, counters and gauges, rendered in the Prometheus
+    # text format. Summaries keep the last 1024 samples for their quantiles.
+
+    def __init__(self, prefix: str = 'music51'):
+        self.prefix = prefix
+        self.summaries: dict = {}
+        self.counters = Counter()
+        self.gauges: dict = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        summary = self.summaries.get(key)
+        if summary is None:
+            summary = self.summaries[key] = Summary()
+        summary.observe(value)
+
+    def increment(self, name: str, amount: int = 1, **labels):
+        self.counters[_key(name, labels)] += amount
+
+    def gauge(self, name: str, callback):
+        # callback returns a number or a {labels: value} dict when rendered
+        self.gauges[name] = callback
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        lines = []
+        for (name, labels), summary in sorted(self.summaries.items()):
+            metric = f'{self.prefix}_{name}_seconds'
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f'{_format(metric, labels, {"quantile": q})} {summary.quantile(q):.6f}')
+            lines.append(f'{_format(metric + "_count", labels)} {summary.count}')
+            lines.append(f'{_format(metric + "_sum", labels)} {summary.total:.6f}')
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f'{_format(f"{self.prefix}_{name}_total", labels)} {value}')
+        for name, callback in sorted(self.gauges.items()):
+            value = callback()
+            if isinstance(value, dict):
+                for labels, labelled in value.items():
+                    lines.append(f'{_format(f"{self.prefix}_{name}", tuple(labels))} {labelled}')
+            else:
+                lines.append(f'{self.prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary_line(self) -> str:
+        parts = [f'{name}{dict(labels) if labels else ""} p50={summary.quantile(0.5) * 1000:.1f}ms '
+                 f'p99={summary.quantile(0.99) * 1000:.1f}ms n={summary.count}'
+                 for (name, labels), summary in sorted(self.summaries.items())]
+        return ' | '.join(parts)
+
+    async def watch_loop_lag(self, interval: float = 0.5):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe('event_loop_lag', max(0.0, time.perf_counter() - started - interval))
+
+    async def log_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print(f'[metrics] {self.summary_line()}')
+
+    async def serve(self, host: str, port: int):
+        async def handler(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f'Serving metrics on http://{host}:{port}/metrics')
+
+
+class SamplingProfiler:
+    # Samples the event loop thread's stack from a background thread and
+    # counts the innermost frames, cheap enough to leave on for a minute.
+
+    def __init__(self, interval: float = 0.005, depth: int = 8):
+        self.interval = interval
+        self.depth = depth
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._running = threading.Event()
+
+    def _run(self):
+        while self._running.is_set():
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.depth:
+                stack.append(f'{frame.f_code.co_filename.rsplit("/", 1)[-1]}:{frame.f_code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                self.samples[' <- '.join(stack)] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.samples.clear()
+        self._thread_id = threading.get_ident()
+        self._running.set()
+        threading.Thread(target=self._run, name='sampling-profiler', daemon=True).start()
+
+    def stop(self, top: int = 10) -> list:
+        self._running.clear()
+        return self.samples.most_common(top)
+
+
+metrics = Metrics()
@@ -0,0 +1,123 @@
+import asyncio
+
+import wavelink
+
+from utils.sharding import shard_for
+
+DEFAULT_NODES = [{'host': '127.0.0.1', 'port': 2333, 'password': '12345'}]
+
+
+def node_penalty(node) -> float:
+    # the load score Lavalink clients usually balance on, lower is better
+    stats = getattr(node, 'stats', None)
+    if stats is None:
+        return float(len(node_players(node)))
+    players = getattr(stats, 'playing_players', len(node_players(node)))
+    cpu = 1.05 ** (100 * getattr(stats, 'system_load', 0)) * 10 - 10
+    deficit = max(getattr(stats, 'frames_deficit', 0), 0)
+    nulled = max(getattr(stats, 'frames_nulled', 0), 0)
+    frames = 1.03 ** (500 * deficit / 3000) * 600 - 600 + (1.03 ** (500 * nulled / 3000) * 300 - 300) * 2
+    return players + cpu + frames
+
+
+def node_players(node) -> list:
+    players = node.players
+    return list(players.values()) if isinstance(players, dict) else list(players)
+
+
+def select_node(nodes: list, region: str = None, regions: dict = None):
+    healthy = [node for node in nodes if node.is_connected()]
+    if region is not None and regions:
+        local = [node for node in healthy if region in regions.get(node.identifier, ())]
+        healthy = local or healthy
+    if not healthy:
+        return None
+    return min(healthy, key=node_penalty)
+
+
+class NodeManager:
+    # Connects every configured Lavalink node, places new players on the
+    # least loaded node of the voice channel's region (and of the guild's
+    # shard, if nodes are tagged with shards) and moves players off nodes that
+    # lost their connection.
+
+    def __init__(self, bot, configs: list = None, check_interval: float = 5.0):
+        self.bot = bot
+        self.configs = configs or DEFAULT_NODES
+        self.check_interval = check_interval
+        self.nodes: dict = {}
+        self.regions: dict = {}
+        self.shards: dict = {}
+        self.moved = 0
+
+    async def connect(self):
+        await self.bot.wait_until_ready()
+        for node_config in self.configs:
+            identifier = node_config.get('identifier', f"{node_config['host']}:{node_config['port']}")
+            self.regions[identifier] = tuple(node_config.get('regions', ()))
+            self.shards[identifier] = frozenset(node_config.get('shards', ()))
+            try:
+                self.nodes[identifier] = await wavelink.NodePool.create_node(bot=self.bot,
+                                                                             host=node_config['host'],
+                                                                             port=node_config['port'],
+                                                                             password=node_config['password'],
+                                                                             https=node_config.get('https', False),
+                                                                             identifier=identifier)
+            except Exception as e:
+                print(f'Failed to connect to node {identifier} with {e}')
+        startup = getattr(self.bot, 'startup', None)
+        if startup is not None:
+            startup.mark('node connect')
+        self.bot.loop.create_task(self.monitor())
+
+    def best_node(self, region: str = None, guild_id: int = None, exclude=()):
+        nodes = [node for node in self.nodes.values() if node not in exclude]
+        shard_count = getattr(self.bot, 'shard_count', None)
+        if guild_id is not None and shard_count:
+            shard = shard_for(guild_id, shard_count)
+            owned = [node for node in nodes if shard in self.shards.get(node.identifier, ())]
+            if any(node.is_connected() for node in owned):
+                nodes = owned
+        return select_node(nodes, region, self.regions)
+
+    async def monitor(self):
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.check_interval)
+            for node in list(self.nodes.values()):
+                if not node.is_connected() and node_players(node):
+                    await self.failover(node)
+
+    async def failover(self, node):
+        for player in node_players(node):
+            target = self.best_node(region=getattr(player.channel, 'rtc_region', None), guild_id=player.guild.id,
+                                    exclude=(node,))
+            if target is None:
+                print(f'No healthy node to move {player.guild.id} to')
+                return
+            try:
+                await self.move(player, target)
+            except Exception as e:
+                print(f'Failed to move {player.guild.id} to {target.identifier} with {e}')
+
+    async def move(self, player: wavelink.Player, target):
+        track = player.track
+        position = int(player.position * 1000)
+        paused = player.is_paused()
+        old = player.node
+        # wavelink has no public way to move a player, re-register it by hand
+        if isinstance(old._players, dict):
+            old._players.pop(player.guild.id, None)
+            target._players[player.guild.id] = player
+        else:
+            old._players.remove(player)
+            target._players.append(player)
+        player.node = target
+        await player._dispatch_voice_update(player._voice_state)
+        if track is not None:
+            await player.play(track, start=position)
+            if paused:
+                await player.pause()
+        # the new node starts the player at 100%, filters would need the same once they are used
+        await player.set_volume(player.volume)
+        self.moved += 1
+        print(f'Moved player of {player.guild.id} from {old.identifier} to {target.identifier}')
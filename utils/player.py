@@ -0,0 +1,15 @@
+import wavelink
+from discord.utils import MISSING
+
+from utils.queue import TrackQueue
+
+
+class MusicPlayer(wavelink.Player):
+    # Lets the bot's NodeManager pick the node when discord.py creates the
+    # player and swaps in the indexed TrackQueue.
+
+    def __init__(self, client=MISSING, channel=MISSING, *, node=MISSING):
+        if node is MISSING and channel is not MISSING and hasattr(client, 'nodes'):
+            node = client.nodes.best_node(region=getattr(channel, 'rtc_region', None), guild_id=channel.guild.id) or MISSING
+        super().__init__(client, channel, node=node)
+        self.queue = TrackQueue()
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import wavelink
+
+from utils.actors import Busy
+from utils.metrics import metrics
+
+
+class Prefetcher:
+    # Checks the next `lookahead` queued tracks against the player's node
+    # before they are due, so dead or region blocked videos are dropped while
+    # the current track still plays. Also measures the gap between one track
+    # ending and the next one starting. Dropped tracks are removed through
+    # the guild's actor, like every other queue change.
+
+    def __init__(self, actors, lookahead: int = 3, revalidate_after: float = 60 * 60):
+        self.actors = actors
+        self.lookahead = lookahead
+        self.revalidate_after = revalidate_after
+        self._validated: dict = {}
+        self._ended: dict = {}
+        self._tasks: dict = {}
+
+    def schedule(self, player: wavelink.Player):
+        task = self._tasks.get(player.guild.id)
+        if task is None or task.done():
+            self._tasks[player.guild.id] = asyncio.get_running_loop().create_task(self._validate(player))
+
+    def track_ended(self, guild_id: int):
+        self._ended[guild_id] = time.monotonic()
+
+    def stopped(self, guild_id: int):
+        # nothing plays next, the following start is not a transition
+        self._ended.pop(guild_id, None)
+
+    def track_started(self, guild_id: int):
+        ended = self._ended.pop(guild_id, None)
+        if ended is not None:
+            metrics.observe('track_gap', time.monotonic() - ended)
+
+    async def _validate(self, player: wavelink.Player):
+        now = time.monotonic()
+        upcoming = [track for _, track in zip(range(self.lookahead), player.queue)]
+        for track in upcoming:
+            key = track.identifier or track.uri
+            if now - self._validated.get(key, float('-inf')) < self.revalidate_after:
+                continue
+            try:
+                found = await player.node.get_tracks(wavelink.YouTubeTrack, track.uri or track.identifier)
+            except wavelink.LoadTrackError:
+                found = None
+            except Exception as e:
+                # the node may just be busy, try again on the next schedule
+                print(f'Could not check {track.title}: {e}')
+                continue
+            if found:
+                self._validated[key] = now
+                continue
+            try:
+                future, _ = self.actors.submit(player.guild.id, 'prefetch_drop',
+                                               lambda count, track=track: self._drop(player, track))
+            except Busy:
+                # left unvalidated, the next schedule tries again
+                continue
+            await future
+        if len(self._validated) > 10000:
+            self._validated = {key: checked for key, checked in self._validated.items()
+                               if now - checked < self.revalidate_after}
+
+    async def _drop(self, player: wavelink.Player, track):
+        try:
+            player.queue.remove(track)
+        except ValueError:
+            # played or removed while it was checked
+            return
+        print(f'Removing unplayable track {track.title} from the queue of {player.guild.id}')
+        metrics.increment('unplayable_dropped')
@@ -0,0 +1,165 @@
+import itertools
+import random
+
+import wavelink
+
+
+class IndexedDeque:
+    # A list with a moving head. Popping from the front only advances the
+    # head, so both ends stay cheap while indexing and slicing are O(1) in the
+    # position, unlike collections.deque which walks its blocks.
+    __slots__ = ('_items', '_head')
+
+    def __init__(self, items=()):
+        self._items = list(items)
+        self._head = 0
+
+    def __len__(self) -> int:
+        return len(self._items) - self._head
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._head, None)
+
+    def __reversed__(self):
+        return (self._items[index] for index in range(len(self._items) - 1, self._head - 1, -1))
+
+    def __contains__(self, item) -> bool:
+        return any(item is other or item == other for other in self)
+
+    def __repr__(self) -> str:
+        return f'IndexedDeque({list(self)!r})'
+
+    def _position(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('queue index out of range')
+        return index + self._head
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self._items[start + self._head:stop + self._head:step]
+        return self._items[self._position(index)]
+
+    def __setitem__(self, index: int, item):
+        self._items[self._position(index)] = item
+
+    def __delitem__(self, index: int):
+        del self._items[self._position(index)]
+
+    def _compact(self):
+        del self._items[:self._head]
+        self._head = 0
+
+    def append(self, item):
+        self._items.append(item)
+
+    def appendleft(self, item):
+        if self._head:
+            self._head -= 1
+            self._items[self._head] = item
+        else:
+            self._items.insert(0, item)
+
+    def extend(self, items):
+        self._items.extend(items)
+
+    def extendleft(self, items):
+        for item in items:
+            self.appendleft(item)
+
+    def insert(self, index: int, item):
+        index = max(0, min(len(self), index if index >= 0 else len(self) + index))
+        self._items.insert(index + self._head, item)
+
+    def pop(self):
+        if not self:
+            raise IndexError('pop from an empty queue')
+        return self._items.pop()
+
+    def popleft(self):
+        if not self:
+            raise IndexError('pop from an empty queue')
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        if self._head > 64 and self._head * 2 > len(self._items):
+            self._compact()
+        return item
+
+    def clear(self):
+        self._items = []
+        self._head = 0
+
+    def index(self, item, start: int = 0) -> int:
+        return self._items.index(item, self._head + start) - self._head
+
+    def remove(self, item):
+        del self._items[self._items.index(item, self._head)]
+
+    def count(self, item) -> int:
+        return sum(1 for other in self if other == item)
+
+    def copy(self):
+        return IndexedDeque(self)
+
+    # wavelink's Queue.copy() goes through copy.copy, which would share _items
+    __copy__ = copy
+
+    def reverse(self):
+        self._compact()
+        self._items.reverse()
+
+    def rotate(self, steps: int = 1):
+        self._compact()
+        if self._items:
+            steps %= len(self._items)
+            self._items[:] = self._items[-steps:] + self._items[:-steps]
+
+    def move(self, source: int, destination: int):
+        item = self._items.pop(self._position(source))
+        self.insert(destination, item)
+
+    def shuffle(self):
+        self._compact()
+        random.shuffle(self._items)
+
+
+class TrackQueue(wavelink.Queue):
+    # wavelink's queue on top of an IndexedDeque, with the operations the
+    # queue commands need. Positions are 0-based here, 1-based in commands.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = IndexedDeque(self._queue)
+
+    def extend(self, iterable, *, atomic: bool = True):
+        # one list extend instead of a put per track
+        if not atomic or (self._overflow and self.max_size is not None):
+            # wavelink adds as many as fit or drops from the front, track by track
+            return super().extend(iterable, atomic=atomic)
+        tracks = self._check_playable_container(iterable)
+        if self.max_size is not None and len(self) + len(tracks) > self.max_size:
+            raise wavelink.QueueFull(f'Queue has {len(self)}/{self.max_size} items, cannot add {len(tracks)} more.')
+        self._queue.extend(tracks)
+
+    def page(self, start: int, count: int) -> list:
+        return self._queue[start:start + count]
+
+    def move(self, source: int, destination: int):
+        self._queue.move(source, destination)
+
+    def remove_at(self, index: int):
+        track = self._queue[index]
+        del self._queue[index]
+        return track
+
+    def remove(self, track):
+        self._queue.remove(track)
+
+    def shuffle(self):
+        self._queue.shuffle()
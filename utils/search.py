@@ -0,0 +1,166 @@
+import heapq
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def word_starts(text: str) -> list:
+    return [i for i, char in enumerate(text) if char.isalnum() and (i == 0 or not text[i - 1].isalnum())]
+
+
+def _contains(posting: array, song_id: int) -> bool:
+    index = bisect_left(posting, song_id)
+    return index < len(posting) and posting[index] == song_id
+
+
+class SearchIndex:
+    # Titles are stored by insertion id. Queries of three or more characters
+    # intersect trigram postings, two characters use bigram postings and a
+    # single character goes through a word-prefix index, so a keystroke never
+    # has to walk every known title.
+
+    def __init__(self, titles=()):
+        self._titles: list = []
+        self._normalized: list = []
+        self._ids: dict = {}
+        self._trigrams: dict = {}
+        self._bigrams: dict = {}
+        self._prefixes: dict = {}
+        self._removed = 0
+        for title in titles:
+            self.add(title)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, title) -> bool:
+        return title in self._ids
+
+    def add(self, title: str) -> bool:
+        if title in self._ids:
+            return False
+        song_id = len(self._titles)
+        normalized = normalize(title)
+        self._ids[title] = song_id
+        self._titles.append(title)
+        self._normalized.append(normalized)
+        for gram in trigrams(normalized):
+            self._trigrams.setdefault(gram, array('I')).append(song_id)
+        for gram in bigrams(normalized):
+            self._bigrams.setdefault(gram, array('I')).append(song_id)
+        for prefix in {normalized[start] for start in word_starts(normalized)}:
+            self._prefixes.setdefault(prefix, array('I')).append(song_id)
+        return True
+
+    def remove(self, title: str) -> bool:
+        song_id = self._ids.pop(title, None)
+        if song_id is None:
+            return False
+        # postings keep the id, the emptied slot is skipped while searching
+        self._titles[song_id] = None
+        self._normalized[song_id] = None
+        self._removed += 1
+        if self._removed > 1024 and self._removed * 2 > len(self._titles):
+            self._rebuild()
+        return True
+
+    def _rebuild(self):
+        titles = [title for title in self._titles if title is not None]
+        self.__init__(titles)
+
+    def _candidates(self, query: str):
+        # returns the candidate ids and whether they cover every possible match
+        if len(query) == 1:
+            return self._prefixes.get(query, ()), False
+        if len(query) == 2:
+            return self._bigrams.get(query, ()), True
+        postings = []
+        for gram in trigrams(query):
+            posting = self._trigrams.get(gram)
+            if posting is None:
+                return (), True
+            postings.append(posting)
+        postings.sort(key=len)
+        if len(postings) == 1:
+            return postings[0], True
+        # the rarest grams narrow things down enough, _rank verifies the rest
+        return (song_id for song_id in postings[0] if all(_contains(posting, song_id) for posting in postings[1:3])), True
+
+    def search(self, query: str, limit: int = 25, boost=None, seed=(), budget: int = 2000) -> list:
+        # `seed` titles are checked before any other candidate, so the ones
+        # `boost` favours are found even when the search stops early
+        query = normalize(query).strip()
+        seed = [title for title in seed if title in self._ids]
+        if not query:
+            if boost is not None:
+                return heapq.nlargest(limit, seed if len(seed) >= limit else self._ids, key=boost)
+            titles = (title for title in self._titles if title is not None)
+            return [title for _, title in zip(range(limit), titles)]
+
+        # 0: title starts with the query, 1: a word does, 2: anywhere else
+        buckets = ([], [], [])
+        candidates, complete = self._candidates(query)
+        seen = set()
+        for title in seed:
+            song_id = self._ids[title]
+            self._rank(song_id, query, buckets)
+            seen.add(song_id)
+        for checked, song_id in enumerate(candidates):
+            if song_id in seen:
+                continue
+            self._rank(song_id, query, buckets)
+            seen.add(song_id)
+            if len(buckets[0]) >= limit:
+                break
+            # once the page is full, only keep looking for better matches for a while
+            if checked >= budget and len(buckets[0]) + len(buckets[1]) + len(buckets[2]) >= limit:
+                break
+        if not complete and len(buckets[0]) + len(buckets[1]) + len(buckets[2]) < limit:
+            # a single character inside a word is not covered by the prefix
+            # index, look through at most `budget` more titles for it
+            for song_id in range(min(len(self._titles), budget)):
+                if song_id not in seen:
+                    self._rank(song_id, query, buckets)
+                if len(buckets[0]) + len(buckets[1]) + len(buckets[2]) >= limit:
+                    break
+
+        results = []
+        for bucket in buckets:
+            if boost is not None:
+                bucket.sort(key=lambda title: -boost(title))
+            results.extend(bucket[:limit - len(results)])
+            if len(results) >= limit:
+                break
+        return results
+
+    def _rank(self, song_id: int, query: str, buckets: tuple):
+        normalized = self._normalized[song_id]
+        if normalized is None:
+            return
+        position = normalized.find(query)
+        if position == -1:
+            return
+        if position == 0:
+            buckets[0].append(self._titles[song_id])
+        elif not normalized[position - 1].isalnum():
+            buckets[1].append(self._titles[song_id])
+        else:
+            # a later occurrence may still start a word
+            for start in word_starts(normalized):
+                if normalized.startswith(query, start):
+                    buckets[1].append(self._titles[song_id])
+                    return
+            buckets[2].append(self._titles[song_id])
@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+
+# keys in data.json that are not guild entries and every process keeps
+GLOBAL_KEYS = ('default Value', 'known_songs', 'song_metadata', 'command_tree_hash')
+
+
+class ShardConfig:
+    __slots__ = ('sharded', 'shard_count', 'shard_ids')
+
+    def __init__(self, sharded: bool = False, shard_count: int = None, shard_ids: list = None):
+        self.sharded = sharded or shard_count is not None
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+
+    @property
+    def partitioned(self) -> bool:
+        # only a process owning a subset of the shards splits its files
+        return self.shard_count is not None and self.shard_ids is not None
+
+    def owns(self, guild_id) -> bool:
+        return not self.partitioned or shard_for(guild_id, self.shard_count) in self.shard_ids
+
+    def bot_kwargs(self) -> dict:
+        kwargs = {}
+        if self.shard_count is not None:
+            kwargs['shard_count'] = self.shard_count
+        if self.shard_ids is not None:
+            kwargs['shard_ids'] = self.shard_ids
+        return kwargs
+
+    def path(self, path: str) -> str:
+        if not self.partitioned:
+            return path
+        root, extension = os.path.splitext(path)
+        return f'{root}.shards-{"-".join(map(str, self.shard_ids))}{extension}'
+
+
+def shard_for(guild_id, shard_count: int) -> int:
+    return (int(guild_id) >> 22) % shard_count
+
+
+def parse_shard_ids(text: str) -> list:
+    # "0-3" or "0,2,4"
+    shard_ids = []
+    for part in str(text).split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            shard_ids.extend(range(int(first), int(last) + 1))
+        elif part.strip():
+            shard_ids.append(int(part))
+    return shard_ids
+
+
+def parse_shard_config(config, argv=None) -> ShardConfig:
+    parser = argparse.ArgumentParser(description='Run the DJ bot')
+    parser.add_argument('--sharded', action='store_true', default=getattr(config, 'sharded', False),
+                        help='let discord.py pick the shard count and run all shards in this process')
+    parser.add_argument('--shard-count', type=int, default=getattr(config, 'shard_count', None))
+    parser.add_argument('--shards', default=getattr(config, 'shard_ids', None),
+                        help='shards owned by this process, e.g. 0-3 or 0,2,4')
+    args = parser.parse_args(argv)
+    shard_ids = args.shards if args.shards is None or isinstance(args.shards, list) else parse_shard_ids(args.shards)
+    if shard_ids is not None and args.shard_count is None:
+        parser.error('--shards needs --shard-count')
+    return ShardConfig(args.sharded, args.shard_count, shard_ids)
+
+
+def partition_file(path: str, shards: ShardConfig) -> str:
+    # First start of a shard range: seed its file with the shared keys and
+    # the guilds it owns from the unpartitioned file.
+    partitioned = shards.path(path)
+    if partitioned != path and not os.path.exists(partitioned) and os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        data = {key: value for key, value in data.items()
+                if key in GLOBAL_KEYS or not key.isdigit() or shards.owns(key)}
+        with open(partitioned, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=4)
+    return partitioned
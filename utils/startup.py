@@ -0,0 +1,46 @@
+import hashlib
+import json
+import time
+
+from utils.metrics import metrics
+
+
+class StartupTimer:
+    # Records how long each startup phase took, relative to the previous
+    # mark, and prints a report once every expected phase has finished.
+
+    def __init__(self, phases: tuple, started: float = None):
+        self.phases = phases
+        self.started = started if started is not None else time.perf_counter()
+        self.durations: dict = {}
+        self._last = self.started
+
+    def mark(self, phase: str):
+        if phase in self.durations:
+            return
+        now = time.perf_counter()
+        self.durations[phase] = now - self._last
+        self._last = now
+        metrics.observe('startup_phase', self.durations[phase], phase=phase.replace(' ', '_'))
+        if all(phase in self.durations for phase in self.phases):
+            print(self.report())
+
+    def report(self) -> str:
+        lines = [f'  {phase:<15} {self.durations[phase] * 1000:8.1f}ms' for phase in self.phases if phase in self.durations]
+        return '\n'.join([f'Startup took {(self._last - self.started) * 1000:.1f}ms'] + lines)
+
+
+def command_payload(tree, guild=None) -> list:
+    payload = []
+    for command in tree.get_commands(guild=guild):
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:
+            # discord.py before 2.4 takes no tree argument
+            payload.append(command.to_dict())
+    return sorted(payload, key=lambda command: (command.get('type', 1), command['name']))
+
+
+def command_tree_hash(tree, guild=None) -> str:
+    encoded = json.dumps(command_payload(tree, guild), sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
@@ -0,0 +1,80 @@
+import time
+
+from utils.messages import MessageHandle
+
+
+class GuildState:
+    # Per-guild player state. Only the fields in `persisted` are written to
+    # data.json, everything else lives as long as the process.
+    __slots__ = ('guild_id', 'loop', 'loop_queue', 'radio', 'message_id', 'saved_queue', 'message', 'last_used')
+    persisted = ('loop', 'loop_queue', 'radio', 'message_id', 'saved_queue')
+
+    def __init__(self, guild_id: str, loop: bool = False, loop_queue: bool = False, radio: bool = False,
+                 message_id=None, saved_queue=None):
+        self.guild_id = guild_id
+        self.loop = loop
+        # finished tracks go back to the end of the queue
+        self.loop_queue = loop_queue
+        # keep playing from the guild's play history once the queue runs out
+        self.radio = radio
+        # [message id, channel id] of the now playing message
+        self.message_id = message_id
+        # serialized tracks of a player that was disconnected while idle
+        self.saved_queue = saved_queue
+        self.message = None
+        self.last_used = time.monotonic()
+
+    @classmethod
+    def from_dict(cls, guild_id: str, data: dict):
+        return cls(guild_id, **{field: data[field] for field in cls.persisted if field in data})
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.persisted}
+
+    def loop_string(self) -> str:
+        if self.loop:
+            return ":white_check_mark: Looping"
+        else:
+            return ":x: Not Looping"
+
+    def set_message(self, handle: MessageHandle):
+        self.message = handle
+        self.message_id = [handle.message_id, handle.channel_id] if handle is not None else None
+
+
+class GuildStates:
+    # Loads guild state from the backing StoredCache on first access and drops
+    # it again once a guild has been idle for `idle_after` seconds.
+
+    def __init__(self, cache, client, idle_after: float = 30 * 60):
+        self.cache = cache
+        self.client = client
+        self.idle_after = idle_after
+        self._states: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, guild_id) -> GuildState:
+        key = str(guild_id)
+        state = self._states.get(key)
+        if state is None:
+            state = GuildState.from_dict(key, self.cache.get(key) or {})
+            if state.message_id is not None:
+                # rebuilt from the ids alone, nothing is fetched until an edit fails
+                state.message = MessageHandle(self.client, state.message_id[1], state.message_id[0])
+            self._states[key] = state
+        state.last_used = time.monotonic()
+        return state
+
+    def save(self, state: GuildState):
+        self.cache.cache[state.guild_id] = state.to_dict()
+        self.cache.mark_dirty(state.guild_id)
+
+    def evict_idle(self, is_active) -> list:
+        cutoff = time.monotonic() - self.idle_after
+        evicted = [key for key, state in self._states.items() if state.last_used < cutoff and not is_active(key)]
+        for key in evicted:
+            del self._states[key]
+            self.cache.release(key)
+        return evicted
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+from Cache.Cache import Cache
+
+from utils.metrics import metrics
+
+# dicts with more entries are encoded entry by entry and without indentation
+LARGE = 256
+
+
+class Store:
+    # Persists a dict of top level keys. Only keys marked dirty are encoded
+    # again, writes are debounced and run in a worker thread. The json backend
+    # rewrites the file atomically from cached per-key fragments, the sqlite
+    # backend upserts one row per dirty key. Large dicts keep one fragment per
+    # entry, so marking a single field dirty only encodes that entry again.
+    # The sqlite database runs in WAL mode, keys loaded on demand are read
+    # through a second connection that never waits for a batch write.
+
+    def __init__(self, path: str, backend: str = 'json', delay: float = 5.0, encode=None):
+        if backend not in ('json', 'sqlite'):
+            raise ValueError(f'Unknown persistence backend {backend}')
+        self.path = path
+        self.backend = backend
+        self.delay = delay
+        self.encode = encode or (lambda key, value: value)
+        self.data: dict = {}
+        self.writes = 0
+        # key -> set of dirty fields, or None when the whole value changed
+        self._dirty: dict = {}
+        self._fragments: dict = {}
+        self._parts: dict = {}
+        # loaded keys without a fragment yet, encoded by the first flush
+        self._unencoded: set = set()
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        self._write_lock = threading.Lock()
+        self._db = None
+        self._reader = None
+
+    @property
+    def db_path(self) -> str:
+        return os.path.splitext(self.path)[0] + '.sqlite3'
+
+    def load(self, data: dict, eager=None):
+        # eager limits what the sqlite backend reads upfront, other keys load on first get()
+        self.data = data
+        if self.backend == 'json':
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as file:
+                    data.update(json.load(file))
+            self._unencoded.update(data)
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._reader = sqlite3.connect(self.db_path, check_same_thread=False)
+        if self._db.execute('SELECT 1 FROM entries LIMIT 1').fetchone() is not None:
+            if eager is None:
+                rows = self._db.execute('SELECT key, value FROM entries').fetchall()
+            else:
+                rows = self._db.execute(f"SELECT key, value FROM entries WHERE key IN ({', '.join('?' * len(eager))})",
+                                        tuple(eager)).fetchall()
+            data.update((key, json.loads(value)) for key, value in rows)
+        elif os.path.exists(self.path):
+            # first start on sqlite, import the existing json file
+            with open(self.path, encoding='utf-8') as file:
+                data.update(json.load(file))
+            self._dirty.update(dict.fromkeys(data))
+            self.flush_sync()
+
+    def get(self, key: str):
+        if key in self.data or self._db is None:
+            return self.data.get(key)
+        row = self._reader.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.data[key] = json.loads(row[0])
+        return self.data[key]
+
+    def release(self, key: str) -> bool:
+        # only the sqlite backend can load a key again later, and only once
+        # a running write has committed it
+        if self._db is None or key in self._dirty or key not in self.data or self._flush_lock.locked():
+            return False
+        del self.data[key]
+        return True
+
+    def mark_dirty(self, key: str, field: str = None):
+        if field is None:
+            self._dirty[key] = None
+        elif key not in self._dirty:
+            self._dirty[key] = {field}
+        elif self._dirty[key] is not None:
+            self._dirty[key].add(field)
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._debounce())
+            except RuntimeError:
+                # no running loop yet, the next flush picks the key up
+                pass
+
+    async def _debounce(self):
+        # keys marked while a write was running are picked up by the next round
+        while self._dirty:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._dirty:
+                with metrics.timer('persistence_write', file=os.path.basename(self.path)):
+                    await asyncio.to_thread(self._write, self._collect())
+
+    def flush_sync(self):
+        if self._dirty:
+            self._write(self._collect())
+
+    def _encode(self, key: str, fields=None):
+        if key not in self.data:
+            self._parts.pop(key, None)
+            return None
+        value = self.encode(key, self.data[key])
+        if isinstance(value, dict) and len(value) > LARGE:
+            parts = self._parts.get(key)
+            if parts is None or fields is None:
+                fields = value
+                parts = self._parts[key] = {}
+            for field in fields:
+                if field in value:
+                    parts[field] = f'{json.dumps(field)}: {json.dumps(value[field], ensure_ascii=True)}'
+                else:
+                    parts.pop(field, None)
+            return '{' + ', '.join(parts.values()) + '}'
+        self._parts.pop(key, None)
+        if isinstance(value, (dict, list)) and len(value) > LARGE:
+            # the indenting encoder is pure Python, the compact one is not
+            return json.dumps(value, ensure_ascii=True)
+        return json.dumps(value, indent=4, ensure_ascii=True).replace('\n', '\n    ')
+
+    def _collect(self) -> list:
+        # runs on the event loop so the data does not change while it is encoded
+        dirty = dict.fromkeys(self._unencoded - self._dirty.keys())
+        dirty.update(self._dirty)
+        changes = [(key, self._encode(key, fields)) for key, fields in dirty.items()]
+        self._dirty.clear()
+        self._unencoded.clear()
+        if self.backend == 'sqlite':
+            return changes
+        for key, fragment in changes:
+            if fragment is None:
+                self._fragments.pop(key, None)
+            else:
+                self._fragments[key] = fragment
+        return list(self._fragments.items())
+
+    def _write(self, payload: list):
+        with self._write_lock:
+            if self.backend == 'sqlite':
+                with self._db:
+                    self._db.executemany('DELETE FROM entries WHERE key = ?',
+                                         [(key,) for key, value in payload if value is None])
+                    self._db.executemany('INSERT INTO entries (key, value) VALUES (?, ?) '
+                                         'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                                         [(key, value) for key, value in payload if value is not None])
+            else:
+                temp_path = f'{self.path}.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as file:
+                    file.write('{\n' + ',\n'.join(f'    {json.dumps(key)}: {fragment}' for key, fragment in payload) + '\n}')
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+            self.writes += 1
+
+
+class StoredCache(Cache):
+    # A Cache whose load/save go through a Store. Mutations have to be
+    # reported with mark_dirty, save() only writes what changed.
+
+    def __init__(self, path: str, backend: str = 'json', delay: float = 5.0):
+        super().__init__(path)
+        self.store = Store(path, backend=backend, delay=delay, encode=self.encode)
+
+    def encode(self, key: str, value):
+        return value
+
+    def load(self, eager=None):
+        self.store.load(self.cache, eager=eager)
+
+    def get(self, key: str, default=None):
+        value = self.store.get(key)
+        if value is None and default is not None:
+            self.cache[key] = value = default
+        return value
+
+    def release(self, key: str) -> bool:
+        return self.store.release(key)
+
+    def mark_dirty(self, key: str, field: str = None):
+        self.store.mark_dirty(key, field)
+
+    async def flush(self):
+        await self.store.flush()
+
+    def save(self):
+        self.store.flush_sync()
@@ -0,0 +1,137 @@
+import asyncio
+import re
+import time
+
+import wavelink
+from utils.metrics import metrics
+from utils.search import normalize
+from utils.store import StoredCache
+
+
+def query_key(query: str) -> str:
+    return ' '.join(normalize(query).split())
+
+
+def split_queries(text: str) -> list:
+    # one search per line or per ';'
+    return [query.strip() for query in re.split(r'[\n;]', text) if query.strip()]
+
+
+def is_playlist(query: str) -> bool:
+    return query.startswith(('https://', 'http://')) and 'list=' in query
+
+
+class TrackCache(StoredCache):
+    # Maps normalized search queries to the encoded Lavalink track and its
+    # info, so repeated searches skip the YouTube round trip. Entries are kept
+    # in insertion order, which doubles as the eviction order.
+
+    def __init__(self, path: str, ttl: int = 7 * 24 * 60 * 60, limit: int = 5000, **kwargs):
+        super().__init__(path, **kwargs)
+        self.ttl = ttl
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._pending: dict = {}
+
+    def purge(self):
+        now = time.time()
+        for key in [key for key, entry in self.cache.items() if entry['expires'] <= now]:
+            del self.cache[key]
+            self.mark_dirty(key)
+        self._evict()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+    async def resolve(self, query: str) -> wavelink.YouTubeTrack:
+        key = query_key(query)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry['expires'] > time.time():
+                self.hits += 1
+                # re-insert so recently used queries are evicted last
+                self.cache[key] = self.cache.pop(key)
+                return wavelink.YouTubeTrack(entry['id'], entry['info'])
+            del self.cache[key]
+            self.mark_dirty(key)
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.get_running_loop().create_task(self._fetch(query, key))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # one cancelled caller must not cancel the lookup for everyone else
+        return await asyncio.shield(task)
+
+    async def resolve_many(self, queries: list, concurrency: int = 5, resolve=None):
+        # Resolves up to `concurrency` queries at a time and yields
+        # (query, track, error) in the original order as soon as each is ready.
+        semaphore = asyncio.Semaphore(concurrency)
+        resolve = resolve or self.resolve
+
+        async def resolve_one(query):
+            async with semaphore:
+                return await resolve(query)
+
+        tasks = [asyncio.ensure_future(resolve_one(query)) for query in queries]
+        try:
+            for query, task in zip(queries, tasks):
+                try:
+                    track = await task
+                except Exception as exc:
+                    yield query, None, exc
+                else:
+                    yield query, track, None if track is not None else LookupError('No results')
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def resolve_playlist(self, url: str) -> list:
+        # playlists are not cached, their contents change
+        with metrics.timer('lavalink_playlist'):
+            playlist = await wavelink.NodePool.get_node().get_playlist(cls=wavelink.YouTubePlaylist, identifier=url)
+        return list(playlist.tracks) if playlist is not None else []
+
+    async def resolve_batch(self, text: str, concurrency: int = 5) -> tuple:
+        # Resolves every query and playlist in `text`, returns the tracks in
+        # input order and the queries that found nothing.
+        async def resolve(query):
+            return await (self.resolve_playlist(query) if is_playlist(query) else self.resolve(query))
+
+        tracks, failed = [], []
+        async for query, result, error in self.resolve_many(split_queries(text), concurrency, resolve=resolve):
+            if error is not None or not result:
+                print(f'Could not load {query}: {error}')
+                failed.append(query)
+            elif isinstance(result, list):
+                tracks.extend(result)
+            else:
+                tracks.append(result)
+        return tracks, failed
+
+    async def _fetch(self, query: str, key: str) -> wavelink.YouTubeTrack:
+        with metrics.timer('lavalink_search'):
+            track = await wavelink.YouTubeTrack.search(query, return_first=True)
+        if track is not None:
+            self.cache[key] = {'id': track.id, 'info': track.info, 'expires': int(time.time() + self.ttl)}
+            self.mark_dirty(key)
+            self._evict()
+        return track
+
+    def _evict(self):
+        while len(self.cache) > self.limit:
+            key = next(iter(self.cache))
+            del self.cache[key]
+            self.mark_dirty(key)
@@ -0,0 +1,96 @@
+import base64
+import struct
+
+import wavelink
+
+
+class _Reader:
+    # Reads the Java DataOutput encoding Lavalink uses for track strings.
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def read(self, fmt: str):
+        value = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return value[0]
+
+    def read_utf(self) -> str:
+        length = self.read('>H')
+        raw = self.data[self.offset:self.offset + length]
+        if len(raw) != length:
+            raise ValueError('Truncated track string')
+        self.offset += length
+        # Java writes modified UTF-8: NUL as two bytes, astral characters as surrogate pairs
+        text = raw.replace(b'\xc0\x80', b'\x00').decode('utf-8', 'surrogatepass')
+        return text.encode('utf-16', 'surrogatepass').decode('utf-16')
+
+    def read_optional_utf(self):
+        return self.read_utf() if self.read('>?') else None
+
+
+def decode_track(encoded: str) -> dict:
+    reader = _Reader(base64.b64decode(encoded, validate=True))
+    header = reader.read('>I')
+    version = reader.read('>B') if header >> 30 & 1 else 1
+    if version > 3:
+        raise ValueError(f'Unsupported track version {version}')
+    info = {
+        'title': reader.read_utf(),
+        'author': reader.read_utf(),
+        'length': reader.read('>q'),
+        'identifier': reader.read_utf(),
+        'isStream': reader.read('>?'),
+        'uri': reader.read_optional_utf() if version >= 2 else None,
+    }
+    if version >= 3:
+        reader.read_optional_utf()  # artwork url
+        reader.read_optional_utf()  # isrc
+    info['sourceName'] = reader.read_utf()
+    info['isSeekable'] = not info['isStream']
+    info['position'] = 0
+    return info
+
+
+def serialize_track(track) -> dict:
+    return {
+        'title': track.title,
+        'track': track.id,
+        'uri': track.uri,
+        'author': track.author,
+        'duration': track.duration,
+    }
+
+
+def track_from_entry(entry: dict):
+    if not entry.get('track'):
+        return None
+    try:
+        return wavelink.YouTubeTrack(entry['track'], decode_track(entry['track']))
+    except (ValueError, struct.error):
+        return None
+
+
+async def load_entry(track_cache, entry: dict):
+    # saved queues resolve locally, only broken or title-only entries are searched again
+    track = track_from_entry(entry)
+    if track is not None:
+        return track
+    track = await track_cache.resolve(entry['title'])
+    if track is not None:
+        entry.update(serialize_track(track))
+    return track
+
+
+def migrate_custom_queues(queues: dict) -> list:
+    # queues.json used to store bare titles, returns the guilds that changed
+    migrated = []
+    for guild_id, guild_queues in queues.items():
+        if not isinstance(guild_queues, dict):
+            continue
+        for name, songs in guild_queues.items():
+            if any(isinstance(song, str) for song in songs):
+                guild_queues[name] = [{'title': song} if isinstance(song, str) else song for song in songs]
+                migrated.append(guild_id)
+    return migrated